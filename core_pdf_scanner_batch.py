@@ -1,49 +1,41 @@
 # harvest_batched.py
-# Two-stage (batched) DOI harvester:
-#  1) For a batch of N DOIs, fetch metadata/OA and download PDFs into downloads/
-#  2) Pause network work; process the batch's PDFs; move each to output_found/ or output_notfound/
+# Two-stage (pipelined) DOI harvester:
+#  1) Fetch metadata/OA for each DOI and download its PDF into downloads/
+#  2) As each PDF lands, process it in a worker process; move it to output_found/ or output_notfound/
 # Usage (CLI):   python harvest_batched.py --config config.yaml
 # Usage (Jupyter):   await harvest_batched.run("config.yaml")
 
-import asyncio, json, logging, logging.handlers, pathlib, re, urllib.parse, argparse, shutil
-from typing import Dict, Any, List, Optional
+import asyncio, contextlib, csv, functools, logging, mmap, os, pathlib, random, re, time, urllib.parse, uuid, argparse
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional
 
+import aiofiles
+from aiolimiter import AsyncLimiter
 import httpx
+import openpyxl
+import orjson
 import pandas as pd
 import yaml
-from pypdf import PdfReader
+import pymupdf
+import xlsxwriter
 from tqdm.asyncio import tqdm_asyncio
 
-CROSSREF = "https://api.crossref.org/works/"
-UNPAYWALL = "https://api.unpaywall.org/v2/"
+from pdfharvest.cache import CacheStore, open_cache_store, sanitize_filename
+from pdfharvest.logging import setup_logging
 
-# ---------------- Logging ----------------
-
-def setup_logging(cfg: Dict[str, Any], out_dir: pathlib.Path):
-    log_cfg = cfg.get("logging", {})
-    level = getattr(logging, log_cfg.get("level", "INFO").upper(), logging.INFO)
-    (out_dir / "logs").mkdir(parents=True, exist_ok=True)
-    log_file = (out_dir / "logs" / log_cfg.get("file", "harvest.log")).resolve()
-    handler = logging.handlers.RotatingFileHandler(
-        log_file, maxBytes=int(log_cfg.get("rotate_bytes", 10_485_760)),
-        backupCount=int(log_cfg.get("backup_count", 5)), encoding="utf-8"
-    )
-    fmt = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
-    logging.basicConfig(level=level, format=fmt, handlers=[handler, logging.StreamHandler()])
-    logging.getLogger("httpx").setLevel(logging.WARNING)
-    return logging.getLogger("harvest")
+try:  # optional C extension: single-pass multi-needle matching
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
+CROSSREF = "https://api.crossref.org/works/"
+CROSSREF_BULK_CHUNK = 40   # DOIs per filter query; keeps the URL clear of 414s
+UNPAYWALL = "https://api.unpaywall.org/v2/"
 
 # ---------------- Utils & dirs ----------------
 
-def sanitize_filename(s: str) -> str:
-    s = s.strip().replace("doi:", "").replace("DOI:", "")
-    return re.sub(r"[^A-Za-z0-9._-]+", "_", s)
-
 def ensure_dirs(base: pathlib.Path, cfg: Dict[str, Any]):
-    (base / "cache" / "crossref").mkdir(parents=True, exist_ok=True)
-    (base / "cache" / "unpaywall").mkdir(parents=True, exist_ok=True)
-    (base / "cache" / "matches").mkdir(parents=True, exist_ok=True)
     # staging + final folders
     (base / cfg["folders"]["downloads"]).mkdir(parents=True, exist_ok=True)
     (base / cfg["folders"]["found"]).mkdir(parents=True, exist_ok=True)
@@ -53,36 +45,128 @@ def load_yaml(path: str) -> Dict[str, Any]:
     with open(path, "r", encoding="utf-8") as f:
         return yaml.safe_load(f) or {}
 
-# simple JSON cache (one file per DOI per namespace)
-def cache_path(base: pathlib.Path, ns: str, doi: str) -> pathlib.Path:
-    return base / "cache" / ns / f"{sanitize_filename(doi)}.json"
-
-def read_cache_json(path: pathlib.Path) -> Optional[Dict[str, Any]]:
-    if path.exists():
+def _stream_dois(path, col: str) -> Iterator[str]:
+    """
+    Yield the non-empty values of column `col` from a .csv, .parquet or Excel input
+    (first sheet), streaming rows instead of loading the whole workbook into pandas.
+    """
+    path = pathlib.Path(path)
+    missing = ValueError(f"Input must contain column '{col}'")
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if col not in (reader.fieldnames or []):
+                raise missing
+            values = (row[col] for row in reader)
+            yield from (v.strip() for v in values if v and v.strip())
+    elif suffix == ".parquet":
+        import pyarrow.parquet as pq   # optional, only for parquet inputs
+        pf = pq.ParquetFile(path)
+        if col not in pf.schema_arrow.names:
+            raise missing
+        for batch in pf.iter_batches(columns=[col]):
+            yield from (str(v).strip() for v in batch.column(0).to_pylist() if v is not None and str(v).strip())
+    else:
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
         try:
-            return json.loads(path.read_text(encoding="utf-8"))
-        except Exception:
-            return None
-    return None
-
-def write_cache_json(path: pathlib.Path, data: Dict[str, Any]):
-    try:
-        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    except Exception as e:
-        logging.getLogger("harvest").warning(f"Cache write failed {path}: {e}")
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = list(next(rows, ()))
+            if col not in header:
+                raise missing
+            idx = header.index(col)
+            for r in rows:
+                v = r[idx] if idx < len(r) else None
+                if v is not None and str(v).strip():
+                    yield str(v).strip()
+        finally:
+            wb.close()
+
+class DoiCtx:
+    """Per-DOI derived strings, computed once up front instead of in every helper."""
+    __slots__ = ("doi", "quoted", "safe")
+
+    def __init__(self, doi: str):
+        self.doi = doi
+        self.quoted = urllib.parse.quote(doi)
+        self.safe = sanitize_filename(doi)
+
+# Cache: the package's SQLite CacheStore (cache/cache.sqlite3), shared with pdfharvest.run_batch.
+# Namespaces the script reads per DOI; a prefetched entry maps each to its record, or None on
+# a miss (a cached {} from a 404 is a hit).
+CACHE_NAMESPACES = ("crossref", "unpaywall", "matches")
+
+def prefetch_cache(store: CacheStore, ctxs: List[DoiCtx]) -> Dict[str, Dict[str, Optional[Dict[str, Any]]]]:
+    """Cached records of every namespace for ctxs, one bulk query per namespace, keyed by DOI."""
+    dois = [c.doi for c in ctxs]
+    found = {ns: store.get_many(dois, ns) for ns in CACHE_NAMESPACES}
+    return {d: {ns: found[ns].get(d) for ns in CACHE_NAMESPACES} for d in dois}
 
 
 # ---------------- HTTP helpers ----------------
 
+# Concurrent requests allowed per host: the APIs take more than publisher PDF servers,
+# and each host gets its own budget so one slow host can't stall the rest.
+HOST_CONCURRENCY = {"api.crossref.org": 8, "api.unpaywall.org": 4, "default": 2}
+_HOST_LIMITS: Dict[str, int] = {}
+_HOST_SEMS: Dict[str, asyncio.Semaphore] = {}
+
+# Requests per second per API host (token bucket): stay under the published rate limits
+# up front instead of discovering them through 429s (backoff stays as the safety net).
+RATE_LIMITS = {"api.crossref.org": 50, "api.unpaywall.org": 10}
+_LIMITERS: Dict[str, AsyncLimiter] = {h: AsyncLimiter(rps, 1) for h, rps in RATE_LIMITS.items()}
+
+def setup_host_limits(cfg: Dict[str, Any]):
+    _HOST_LIMITS.clear(); _HOST_SEMS.clear()
+    _HOST_LIMITS.update(HOST_CONCURRENCY)
+    _HOST_LIMITS.update({k: int(v) for k, v in (cfg.get("host_concurrency") or {}).items()})
+    rates = {**RATE_LIMITS, **(cfg.get("rate_limits") or {})}
+    _LIMITERS.clear()
+    _LIMITERS.update({h: AsyncLimiter(float(rps), 1) for h, rps in rates.items()})
+
+def rate_limit(url: str):
+    """Token bucket for url's host (a no-op for hosts without a rate limit)."""
+    return _LIMITERS.get(httpx.URL(url).host) or contextlib.nullcontext()
+
+def host_slot(url: str):
+    """Per-host semaphore for url (a no-op until setup_host_limits has run)."""
+    if not _HOST_LIMITS:
+        return contextlib.nullcontext()
+    host = httpx.URL(url).host
+    if host not in _HOST_SEMS:
+        _HOST_SEMS[host] = asyncio.Semaphore(_HOST_LIMITS.get(host, _HOST_LIMITS["default"]))
+    return _HOST_SEMS[host]
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Retry-After header as seconds from now (delta-seconds or HTTP-date); None if absent/invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+def backoff_wait(i: int, retry_after: Optional[float] = None, base: float = 0.5) -> float:
+    """
+    Seconds to sleep before retry i. Jittered so coroutines that failed together don't
+    retry in lockstep: ±50% on the exponential step, only upwards (+50%) on a server hint.
+    """
+    if retry_after is not None:
+        return max(0.1, retry_after) * random.uniform(1.0, 1.5)
+    return min(base * (2**i), 10.0) * random.uniform(0.5, 1.5)
+
 async def backoff_request(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
     log = logging.getLogger("harvest")
-    max_tries, base = 6, 0.5
+    max_tries = 6
     for i in range(max_tries):
         try:
-            r = await client.request(method, url, **kwargs)
+            async with rate_limit(url), host_slot(url):
+                r = await client.request(method, url, **kwargs)
             if r.status_code in (429, 500, 502, 503, 504):
-                ra = r.headers.get("Retry-After")
-                wait = float(ra) if ra else min(base * (2**i), 10.0)
+                wait = backoff_wait(i, retry_after_seconds(r.headers.get("Retry-After")))
                 log.warning(f"{r.status_code} {url} → backoff {wait:.2f}s (try {i+1}/{max_tries})")
                 await asyncio.sleep(wait); continue
             r.raise_for_status()
@@ -91,107 +175,277 @@ async def backoff_request(client: httpx.AsyncClient, method: str, url: str, **kw
             if i == max_tries - 1:
                 log.error(f"HTTP error {url}: {e}")
                 raise
-            await asyncio.sleep(min(base * (2**i), 10.0))
+            await asyncio.sleep(backoff_wait(i))
     raise RuntimeError("unreachable")
 
-async def fetch_crossref(client: httpx.AsyncClient, doi: str) -> Dict[str, Any]:
-    r = await backoff_request(client, "GET", CROSSREF + urllib.parse.quote(doi), timeout=20)
-    return r.json().get("message", {})
+async def fetch_crossref(client: httpx.AsyncClient, doi: str, quoted: Optional[str] = None) -> Dict[str, Any]:
+    r = await backoff_request(client, "GET", CROSSREF + (quoted or urllib.parse.quote(doi)), timeout=20)
+    return orjson.loads(r.content).get("message", {})
 
-async def fetch_unpaywall(client: httpx.AsyncClient, doi: str, email: str) -> Dict[str, Any]:
-    r = await backoff_request(client, "GET", UNPAYWALL + urllib.parse.quote(doi),
+async def fetch_crossref_bulk(client: httpx.AsyncClient, dois: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Crossref metadata for many DOIs at once via /works?filter=doi:...,doi:...
+    (one request per CROSSREF_BULK_CHUNK DOIs instead of one per DOI).
+    Returns {lowercased DOI: record}; DOIs Crossref doesn't know are simply absent.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    for start in range(0, len(dois), CROSSREF_BULK_CHUNK):
+        chunk = dois[start:start + CROSSREF_BULK_CHUNK]
+        params = {"filter": ",".join(f"doi:{d}" for d in chunk), "rows": len(chunk)}
+        r = await backoff_request(client, "GET", CROSSREF.rstrip("/"), params=params, timeout=40)
+        for item in orjson.loads(r.content).get("message", {}).get("items", []):
+            if item.get("DOI"):
+                out[item["DOI"].lower()] = item
+    return out
+
+async def fetch_unpaywall(client: httpx.AsyncClient, doi: str, email: str,
+                          quoted: Optional[str] = None) -> Dict[str, Any]:
+    r = await backoff_request(client, "GET", UNPAYWALL + (quoted or urllib.parse.quote(doi)),
                               params={"email": email}, timeout=20)
     if r.status_code == 404:
         return {}
-    return r.json()
+    return orjson.loads(r.content)
+
+# hosts whose "PDF" links land on login walls / HTML viewers; never worth a download
+_pdf_url_blocked = re.compile(
+    r"https?://(?:[^/]*\.)?(?:ssrn\.com|researchgate\.net|academia\.edu)(?:[:/]|$)", re.I).match
+
+def pdf_url_is_supported(url: str) -> bool:
+    return _pdf_url_blocked(url) is None
+
+def _pdf_candidates(ua: Dict[str, Any]) -> Iterator[str]:
+    """Candidate URLs, best first: direct PDF links before landing pages; within each,
+    best_oa_location, then publisher-hosted copies, then repositories."""
+    best = ua.get("best_oa_location")
+    locs = [l for l in [best, *(ua.get("oa_locations") or [])] if l]
+    locs.sort(key=lambda l: (l is not best, l.get("host_type") != "publisher"))
+    for key in ("url_for_pdf", "url"):
+        for loc in locs:
+            url = loc.get(key)
+            if url: yield url
 
 def best_pdf_url(ua: Dict[str, Any]) -> Optional[str]:
     if not ua: return None
-    loc = ua.get("best_oa_location") or {}
-    pdf = loc.get("url_for_pdf") or loc.get("url")
-    if pdf: return pdf
-    for loc in ua.get("oa_locations") or []:
-        pdf = loc.get("url_for_pdf") or loc.get("url")
-        if pdf: return pdf
-    return None
+    return next((u for u in _pdf_candidates(ua) if pdf_url_is_supported(u)), None)
+
+def is_closed_access(ua: Dict[str, Any]) -> bool:
+    """Unpaywall says closed (is_oa False) and lists no publisher-hosted copy."""
+    return ua.get("is_oa") is False and \
+        not any(l.get("host_type") == "publisher" for l in ua.get("oa_locations") or [])
 
 async def download_pdf(client: httpx.AsyncClient, url: str, out_path: pathlib.Path) -> bool:
     log = logging.getLogger("harvest")
+    # unique per call (the same DOI can be in flight twice): renamed into place when complete
+    part = out_path.with_name(f"{out_path.name}.{uuid.uuid4().hex[:8]}.part")
     try:
-        async with client.stream("GET", url, timeout=40) as r:
+        async with host_slot(url), client.stream("GET", url, timeout=40) as r:
             if r.status_code >= 400:
                 log.warning(f"PDF {url} → {r.status_code}")
                 return False
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(out_path, "wb") as f:
-                async for chunk in r.aiter_bytes():
-                    f.write(chunk)
-        with open(out_path, "rb") as f:
-            if f.read(4) != b"%PDF":
+            # check the magic header on the first bytes, before anything touches the disk
+            chunks = r.aiter_bytes(65536)
+            head = b""
+            async for chunk in chunks:
+                head += chunk
+                if len(head) >= 4:
+                    break
+            if head[:4] != b"%PDF":
                 log.warning(f"Not a PDF (magic header) → {url}")
-                out_path.unlink(missing_ok=True); return False
+                return False
+            async with aiofiles.open(part, "wb") as f:  # downloads/ exists (ensure_dirs)
+                await f.write(head)
+                async for chunk in chunks:
+                    await f.write(chunk)
+        part.replace(out_path)
         return True
     except Exception as e:
         log.warning(f"PDF download failed {url}: {e}")
+        part.unlink(missing_ok=True)   # never leave a truncated PDF to be reused
         return False
 
 
 # ---------------- PDF processing & moves ----------------
 
-def search_pdf(pdf_path: pathlib.Path, needles: List[str]) -> Dict[str, Any]:
+def build_automaton(needles: List[str]):
     """
-    Text search (casefolded substrings). If you need OCR later, add an opt-in pass here.
+    Aho–Corasick automaton over the casefolded needles (None if pyahocorasick is missing).
+    With it search_pdf scans each page in one pass, whatever the number of needles.
     """
-    res = {"found": False, "matches": [], "pages": []}
+    if ahocorasick is None or not needles:
+        return None
+    A = ahocorasick.Automaton()
+    for n in needles:
+        cf = n.casefold()
+        A.add_word(cf, cf)
+    A.make_automaton()
+    return A
+
+# One automaton per needle set and process: worker processes warm it up in their
+# initializer, the thread-executor fallback builds it on first use.
+@functools.lru_cache(maxsize=8)
+def _automaton_for(needles: tuple):
+    return build_automaton(list(needles))
+
+def _init_search_worker(needles: List[str]):
+    _automaton_for(tuple(needles))
+
+def _scan_pages(buf: memoryview, needles: List[str], automaton,
+                stop_on_first_match: bool, want_all_pages: bool):
+    """Page loop of search_pdf; releases `buf` so the caller can close its mmap."""
+    doc = None
     try:
-        reader = PdfReader(str(pdf_path))
-        ns = [n.casefold() for n in needles]
+        doc = pymupdf.open(stream=buf, filetype="pdf")
+        ns = _casefolded(tuple(needles))
+        n_unique = len(ns)
         hits, pages = set(), set()
-        for i, p in enumerate(reader.pages):
+        for i, page in enumerate(doc):
             try:
-                txt = (p.extract_text() or "").casefold()
+                txt = page.get_text("text").casefold()
             except Exception:
                 txt = ""
             if not txt:
                 continue
             page_hit = False
-            for n in ns:
-                if n in txt:
+            if automaton is not None:
+                for _, n in automaton.iter(txt):
                     hits.add(n); page_hit = True
+            else:
+                for n in ns:
+                    if n in txt:
+                        hits.add(n); page_hit = True
             if page_hit:
                 pages.add(i + 1)
+                if stop_on_first_match or (len(hits) == n_unique and not want_all_pages):
+                    break
+        return hits, pages
+    finally:
+        if doc is not None:
+            doc.close()
+        del doc
+        buf.release()
+
+@functools.lru_cache(maxsize=8)
+def _casefolded(needles: tuple) -> tuple:
+    """Casefolded, de-duplicated needles, computed once per needle set and process."""
+    return tuple(dict.fromkeys(n.casefold() for n in needles))
+
+@functools.lru_cache(maxsize=8)
+def _needle_bytes(needles: tuple) -> tuple:
+    """Lowercased UTF-8 and Latin-1 encodings of each needle, for the raw-bytes prefilter."""
+    out = set()
+    for n in needles:
+        low = n.lower()
+        out.add(low.encode("utf-8"))
+        with contextlib.suppress(UnicodeEncodeError):
+            out.add(low.encode("latin-1"))
+    return tuple(out)
+
+def _bytes_prefilter_miss(mm: mmap.mmap, needles: List[str]) -> bool:
+    """
+    Heuristic: True when no needle occurs in the raw file, so parsing can be skipped.
+    Only trusted for files without any stream /Filter (compressed text never matches);
+    text split by kerning arrays can still slip through, hence the opt-in toggle.
+    """
+    if mm.find(b"/Filter") != -1:
+        return False
+    low = mm[:].lower()
+    return not any(nb in low for nb in _needle_bytes(tuple(needles)))
+
+def search_pdf(pdf_path: pathlib.Path, needles: List[str], automaton=None,
+               stop_on_first_match: bool = False, bytes_prefilter: bool = False,
+               want_all_pages: bool = False) -> Dict[str, Any]:
+    """
+    Text search (casefolded substrings) over PyMuPDF's C text extractor.
+    With an automaton (see build_automaton) every page is scanned once for all needles;
+    otherwise fall back to one substring scan per needle.
+    Stops reading pages once every needle has matched, unless want_all_pages is set
+    (then "pages" lists every page with a match), or at the first matching page with
+    stop_on_first_match (enough for found/notfound routing).
+    The file is memory-mapped and handed to PyMuPDF as a buffer, so pages come straight
+    from the OS page cache (shared by all workers) instead of per-process copies.
+    bytes_prefilter skips parsing uncompressed files whose raw bytes contain no needle.
+    If you need OCR later, add an opt-in pass here.
+    """
+    res = {"found": False, "matches": [], "pages": []}
+    if automaton is None:
+        automaton = _automaton_for(tuple(needles))
+    try:
+        with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if bytes_prefilter and _bytes_prefilter_miss(mm, needles):
+                return res
+            hits, pages = _scan_pages(memoryview(mm), needles, automaton, stop_on_first_match, want_all_pages)
         if hits:
             res.update(found=True, matches=sorted(hits), pages=sorted(pages))
     except Exception as e:
         logging.getLogger("harvest").warning(f"PDF parse failed {pdf_path}: {e}")
     return res
 
+def _claim(src: pathlib.Path, target: pathlib.Path) -> pathlib.Path:
+    """
+    Reserve target with an exclusive create (FileExistsError if the name is taken, also
+    by a concurrent move), then move src over the placeholder.
+    """
+    with open(target, "xb"):
+        pass
+    try:
+        return src.replace(target)
+    except BaseException:
+        target.unlink(missing_ok=True)
+        raise
+
+
 def move_pdf_atomic(src: pathlib.Path, dst_dir: pathlib.Path) -> pathlib.Path:
     """
     Move a file atomically, preserving name; if collision, append a counter.
     """
     dst_dir.mkdir(parents=True, exist_ok=True)
-    target = dst_dir / src.name
-    if not target.exists():
-        return src.replace(target)
     stem, suf = src.stem, src.suffix
-    k = 1
+    cand = dst_dir / src.name
+    existing = None
+    k = 0
     while True:
-        cand = dst_dir / f"{stem}_{k}{suf}"
-        if not cand.exists():
-            return src.replace(cand)
+        try:
+            return _claim(src, cand)
+        except FileExistsError:
+            pass
+        # collisions only happen on reruns or sanitized-name clashes: list the
+        # directory once instead of stat()ing name_1, name_2, ... until one is free
+        if existing is None:
+            existing = {e.name for e in os.scandir(dst_dir)}
         k += 1
+        while f"{stem}_{k}{suf}" in existing:
+            k += 1
+        cand = dst_dir / f"{stem}_{k}{suf}"
 
 
 # ---------------- Per-DOI "prepare" (metadata + OA + download) ----------------
 
+def meta_from_unpaywall(oa: Dict[str, Any]) -> Dict[str, Any]:
+    """The Crossref-shaped fields the report uses, taken from an Unpaywall record."""
+    if not oa:
+        return {}
+    return {
+        "title": [oa["title"]] if oa.get("title") else [],
+        "container-title": [oa["journal_name"]] if oa.get("journal_name") else [],
+        "issued": {"date-parts": [[oa.get("year")]]},
+        "author": oa.get("z_authors") or [],
+        "publisher": oa.get("publisher") or "",
+        "type": oa.get("genre") or "",
+        "URL": oa.get("doi_url") or "",
+    }
+
 async def prepare_one(
-    doi: str, cfg: Dict[str, Any], api_client: httpx.AsyncClient, pdf_client: httpx.AsyncClient,
-    out_dir: pathlib.Path
+    ctx: DoiCtx, cfg: Dict[str, Any], client: httpx.AsyncClient,
+    out_dir: pathlib.Path, store: CacheStore, xref_meta: Optional[Dict[str, Any]] = None,
+    cached: Optional[Dict[str, Optional[Dict[str, Any]]]] = None,
 ) -> Dict[str, Any]:
     """
     Stage 1 for a DOI:
-      - Load or fetch Crossref + Unpaywall
+      - Load or fetch Unpaywall; its record already carries the report's metadata, so
+        Crossref is only consulted when it's cached, was fetched in bulk (xref_meta),
+        Unpaywall lacks a title, or cfg["require_crossref"] is set
+      - cached: this DOI's entry from prefetch_cache; when given the store is not queried
+        again, so a fully cached DOI does no I/O here
       - If OA PDF URL exists, download to downloads/ (staging folder)
       - Return a record with: metadata, OA status, temp pdf path (if any)
     """
@@ -199,37 +453,49 @@ async def prepare_one(
     cache_en   = bool(cfg.get("cache", {}).get("enabled", True))
     force_ref  = bool(cfg.get("cache", {}).get("force_refresh", False))
     downloads  = out_dir / cfg["folders"]["downloads"]
-    # cache files
-    xref_cache = cache_path(out_dir, "crossref", doi)
-    upw_cache  = cache_path(out_dir, "unpaywall", doi)
+    doi = ctx.doi
 
     # cached?
-    meta = read_cache_json(xref_cache) if (cache_en and not force_ref) else None
-    oa   = read_cache_json(upw_cache)  if (cache_en and not force_ref) else None
+    # (store I/O goes through a thread so the event loop keeps serving other DOIs)
+    if not cache_en or force_ref:
+        meta, oa = None, None
+    else:
+        if cached is None:
+            cached = (await asyncio.to_thread(prefetch_cache, store, [ctx]))[doi]
+        meta, oa = cached["crossref"], cached["unpaywall"]
 
-    if meta is None:
-        try:
-            meta = await fetch_crossref(api_client, doi)
-            if cache_en: write_cache_json(xref_cache, meta)
-        except Exception:
-            meta = {}
     if oa is None:
         try:
-            oa = await fetch_unpaywall(api_client, doi, cfg["email"])
-            if cache_en: write_cache_json(upw_cache, oa)
+            oa = await fetch_unpaywall(client, doi, cfg["email"], ctx.quoted)
+            if cache_en: await asyncio.to_thread(store.put, doi, "unpaywall", oa)
         except Exception:
             oa = {}
+    if meta is None and xref_meta is not None:
+        meta = xref_meta
+        if cache_en: await asyncio.to_thread(store.put, doi, "crossref", meta)
+    if meta is None:
+        upw_meta = meta_from_unpaywall(oa)
+        if upw_meta.get("title") and not cfg.get("require_crossref", False):
+            meta = upw_meta
+        else:
+            try:
+                meta = await fetch_crossref(client, doi, ctx.quoted)
+                if cache_en: await asyncio.to_thread(store.put, doi, "crossref", meta)
+            except Exception:
+                meta = upw_meta
 
     pdf_url = best_pdf_url(oa)
+    if pdf_url and cfg.get("only_oa", True) and is_closed_access(oa):
+        pdf_url = None  # such downloads practically always fail
     temp_pdf = ""
     if pdf_url:
         # Always stage to downloads/ first
-        fname = f"{sanitize_filename(doi)}.pdf"
+        fname = f"{ctx.safe}.pdf"
         tgt = downloads / fname
         if tgt.exists() and not force_ref:
             temp_pdf = str(tgt)
         else:
-            ok = await download_pdf(pdf_client, pdf_url, tgt)
+            ok = await download_pdf(client, pdf_url, tgt)
             if ok:
                 temp_pdf = str(tgt)
 
@@ -260,78 +526,100 @@ async def prepare_one(
 
 # ---------------- Stage 2: process + route to found/notfound ----------------
 
-async def process_batch_pdfs(rows: List[Dict[str, Any]], cfg: Dict[str, Any], out_dir: pathlib.Path):
+async def process_pdf(ctx: DoiCtx, r: Dict[str, Any], cfg: Dict[str, Any], out_dir: pathlib.Path,
+                      store: CacheStore, pool: Optional[ProcessPoolExecutor] = None,
+                      cached: Optional[Dict[str, Optional[Dict[str, Any]]]] = None):
     """
-    For the batch's rows that have a staged PDF:
-      - Search each PDF (thread executor)
+    For a row with a staged PDF:
+      - Search the PDF (process pool if given, else thread executor) unless the match is
+        cached (cached: this DOI's prefetch_cache entry; None queries the store)
       - Depending on hit, move the file to output_found/ or output_notfound/
-      - Update rows in-place with match info & final path
+      - Update the row in-place with match info & final path
       - Cache match results (so re-runs are fast)
     """
+    if not r.get("pdf_temp_path"):   # nothing to process
+        return
     log = logging.getLogger("harvest")
     needles = cfg.get("strings", [])
+    first_only = bool(cfg.get("search", {}).get("stop_on_first_match", False))
+    prefilter  = bool(cfg.get("search", {}).get("bytes_prefilter", False))
+    all_pages  = bool(cfg.get("search", {}).get("want_all_pages", False))
     cache_en   = bool(cfg.get("cache", {}).get("enabled", True))
     force_ref  = bool(cfg.get("cache", {}).get("force_refresh", False))
 
-    found_dir    = out_dir / cfg["folders"]["found"]
-    notfound_dir = out_dir / cfg["folders"]["notfound"]
-
-    # Build tasks only for rows with a temp PDF and not cached match (unless force_refresh)
-    to_process = []
-    for r in rows:
-        if not r.get("pdf_temp_path"):   # nothing to process
-            continue
-        m_cache = cache_path(out_dir, "matches", r["doi"])
-        cached = read_cache_json(m_cache) if (cache_en and not force_ref) else None
-        to_process.append((r, m_cache, cached))
-
-    loop = asyncio.get_running_loop()
-    # run PDF parsing concurrently in thread pool
-    futs = []
-    for r, m_cache, cached in to_process:
-        if cached is not None:
-            r["match_found"] = bool(cached.get("found"))
-            r["matched_strings"] = ", ".join(cached.get("matches", []))
-            r["match_pages"] = ", ".join(map(str, cached.get("pages", [])))
-            continue
-        futs.append(loop.run_in_executor(None, search_pdf, pathlib.Path(r["pdf_temp_path"]), needles))
-
-    # collect fresh parsing results in the same order
-    idx = 0
-    for r, m_cache, cached in to_process:
-        if cached is not None:
-            # will move below based on cached result
-            pass
+    res = None
+    if cache_en and not force_ref:
+        if cached is None:
+            cached = (await asyncio.to_thread(prefetch_cache, store, [ctx]))[ctx.doi]
+        res = cached["matches"]
+    if res is None:
+        pdf_path = pathlib.Path(r["pdf_temp_path"])
+        if pool is not None:
+            res = await asyncio.wrap_future(pool.submit(search_pdf, pdf_path, needles, None, first_only, prefilter, all_pages))
         else:
-            res = await futs[idx]; idx += 1
-            r["match_found"] = bool(res.get("found"))
-            r["matched_strings"] = ", ".join(res.get("matches", []))
-            r["match_pages"] = ", ".join(map(str, res.get("pages", [])))
-            if cache_en:
-                write_cache_json(m_cache, res)
-
-        # move the staged file according to match flag
-        src = pathlib.Path(r["pdf_temp_path"])
-        if not src.exists():
-            continue  # might have been moved already on a previous run
-        dest_dir = found_dir if r["match_found"] else notfound_dir
-        final_path = move_pdf_atomic(src, dest_dir)
-        r["pdf_final_path"] = str(final_path)
-        # wipe temp path so re-runs won't try to move again
-        r["pdf_temp_path"] = ""
-        log.debug(f"Routed {r['doi']} → {'FOUND' if r['match_found'] else 'NOTFOUND'} | {final_path.name}")
+            res = await asyncio.get_running_loop().run_in_executor(
+                None, search_pdf, pdf_path, needles, None, first_only, prefilter, all_pages)
+        if cache_en:
+            await asyncio.to_thread(store.put, ctx.doi, "matches", res)
+    r["match_found"] = bool(res.get("found"))
+    r["matched_strings"] = ", ".join(res.get("matches", []))
+    r["match_pages"] = ", ".join(map(str, res.get("pages", [])))
+
+    # move the staged file according to match flag
+    src = pathlib.Path(r["pdf_temp_path"])
+    if not src.exists():
+        return  # might have been moved already on a previous run
+    dest_dir = out_dir / cfg["folders"]["found" if r["match_found"] else "notfound"]
+    final_path = move_pdf_atomic(src, dest_dir)
+    r["pdf_final_path"] = str(final_path)
+    # wipe temp path so re-runs won't try to move again
+    r["pdf_temp_path"] = ""
+    log.debug(f"Routed {r['doi']} → {'FOUND' if r['match_found'] else 'NOTFOUND'} | {final_path.name}")
 
 
 # ---------------- Orchestrator ----------------
 
+def write_xlsx(path: pathlib.Path, rows: List[Dict[str, Any]]):
+    """
+    Write rows with xlsxwriter in constant_memory mode: each row is flushed as soon as the
+    next one starts, so memory stays flat however large the report is. (pandas' to_excel
+    writes column by column, which constant_memory can't handle.)
+    """
+    cols = list(rows[0]) if rows else []
+    wb = xlsxwriter.Workbook(str(path), {"constant_memory": True})
+    try:
+        ws = wb.add_worksheet()
+        ws.write_row(0, 0, cols)
+        for i, row in enumerate(rows, start=1):
+            ws.write_row(i, 0, [row.get(c) for c in cols])
+    finally:
+        wb.close()
+
+
+async def gather_or_cancel(*aws):
+    """
+    asyncio.gather that cancels the awaitables still running when one of them raises, so
+    no task is left orphaned (asyncio.TaskGroup does this too, but needs Python 3.11).
+    """
+    tasks = [asyncio.ensure_future(a) for a in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 async def run(cfg_path: str):
     """
-    Batch orchestrator:
+    Pipelined orchestrator:
       - Read config + Excel DOIs
-      - For DOIs in chunks of batch_size:
-          * Stage 1: concurrently prepare (metadata+OA) and download PDFs into downloads/
-          * Stage 2: pause downloading; process batch PDFs and move to final folders
-      - Append results and write report.xlsx/.csv at the end (and optionally after each batch)
+      - Stage 1 (`concurrency` producers): prepare (metadata+OA) and download PDFs into downloads/
+      - Stage 2 (`pdf_workers` consumers): process each staged PDF as soon as it is ready
+        and move it to its final folder, while Stage 1 keeps downloading
+      - Write report.xlsx/.csv at the end (and optionally append to report.csv every
+        batch_size finished rows); if the run fails, the rows finished so far are still
+        written before the error is re-raised
     """
     cfg = load_yaml(cfg_path)
     out_dir = pathlib.Path(cfg.get("output_dir", "output")).resolve()
@@ -341,62 +629,142 @@ async def run(cfg_path: str):
     log = setup_logging(cfg, out_dir)
     log.info("Starting batched DOI harvest")
 
-    # input
-    df = pd.read_excel(cfg["input_excel"])
+    # input (.xlsx / .csv / .parquet), streamed: only the DOI column is read
     doi_col = cfg.get("doi_column", "doi")
-    if doi_col not in df.columns:
-        raise ValueError(f"Excel must contain column '{doi_col}'")
-    dois = [str(x).strip() for x in df[doi_col].dropna().tolist()]
+    dois = list(_stream_dois(cfg["input_excel"], doi_col))
     log.info(f"Loaded {len(dois)} DOIs")
 
     # HTTP clients (kept open across batches)
     headers = {"User-Agent": cfg.get("http", {}).get("user_agent", f"doi-harvest/2.0 (+{cfg.get('email','')})")}
     limits = httpx.Limits(
-        max_keepalive_connections=int(cfg.get("http", {}).get("max_keepalive", 20)),
-        max_connections=int(cfg.get("http", {}).get("max_connections", 20)),
+        max_keepalive_connections=int(cfg.get("http", {}).get("max_keepalive", 40)),
+        max_connections=int(cfg.get("http", {}).get("max_connections", 40)),
     )
     timeout = httpx.Timeout(
         float(cfg.get("timeouts", {}).get("read", 30.0)),
         connect=float(cfg.get("timeouts", {}).get("connect", 15.0))
     )
     batch_size = int(cfg.get("batch_size", 5))
-    # polite parallelism *within a batch* (metadata+downloads)
-    per_batch_concurrency = int(cfg.get("concurrency", min(batch_size, 6)))
-
-    all_rows: List[Dict[str, Any]] = []
-    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=timeout, http2=True) as api_client, \
-               httpx.AsyncClient(headers=headers, limits=limits, timeout=timeout, http2=True) as pdf_client:
-
-        for start in range(0, len(dois), batch_size):
-            chunk = dois[start:start + batch_size]
-            log.info(f"Batch {start//batch_size + 1}: preparing {len(chunk)} DOIs")
-            sem = asyncio.Semaphore(per_batch_concurrency)
+    # Stage 1 workers; the per-host slots (host_concurrency) keep each server's load polite
+    concurrency = int(cfg.get("concurrency", min(batch_size, 6)))
+    setup_host_limits(cfg)
+
+    # Stage 2 parsing is CPU-bound (GIL-bound in threads): fan it out over worker processes
+    n_workers = int(cfg.get("pdf_workers") or os.cpu_count() or 1)
+    pool = ProcessPoolExecutor(max_workers=n_workers,
+                               initializer=_init_search_worker, initargs=(cfg.get("strings", []),))
+    # Pipeline: Stage 1 producers stream prepared rows into a bounded queue, Stage 2 consumers
+    # parse + route each PDF as soon as it lands, so downloads and parsing overlap.
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2 * batch_size)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(dois)
+    ctxs = [DoiCtx(d) for d in dois]
+    pending = iter(enumerate(ctxs))   # shared by all producers
+    progress = tqdm_asyncio(total=len(dois), desc="Harvest")
+    done = 0
+    # checkpoints only append the rows finished since the last one (O(batch), not O(total))
+    report_csv = out_dir / "report.csv"
+    report_csv.unlink(missing_ok=True)
+    unflushed: List[Dict[str, Any]] = []
+
+    def all_rows() -> List[Dict[str, Any]]:
+        return [r for r in results if r is not None]   # input order
+
+    def write_report() -> pd.DataFrame:
+        # final report, in input order; the xlsx is written once, at the end
+        out_df = pd.DataFrame(all_rows())
+        out_df.to_csv(report_csv, index=False, encoding="utf-8")
+        write_xlsx(out_dir / "report.xlsx", all_rows())
+        return out_df
+
+    # the package's cache: runs of either entry point reuse each other's records
+    store = open_cache_store(out_dir)
+    try:
+        # one client for APIs and PDFs: HTTP/2 connections to the same host are shared and multiplexed
+        async with httpx.AsyncClient(headers=headers, limits=limits, timeout=timeout, http2=True) as client:
+            # warm up: open the API connections (TCP+TLS) once, before the first batch needs them
+            await asyncio.gather(client.head(CROSSREF), client.head(UNPAYWALL), return_exceptions=True)
+
+            use_cache = bool(cfg.get("cache", {}).get("enabled", True)) and \
+                not cfg.get("cache", {}).get("force_refresh", False)
+            # Cache reads happen one window of DOIs at a time, ahead of the producers: one bulk
+            # query per namespace instead of per-DOI lookups, while memory stays bounded by the
+            # window rather than growing with the input. Entries are dropped once taken.
+            window = 8 * max(batch_size, concurrency)
+            prefetched = 0    # ctxs[:prefetched] have been loaded
+            ahead: Dict[str, Dict[str, Any]] = {}
+            xref_bulk: Dict[str, Dict[str, Any]] = {}
+            load_lock = asyncio.Lock()
+
+            async def load_window():
+                nonlocal prefetched
+                chunk = ctxs[prefetched:prefetched + window]
+                prefetched += len(chunk)
+                if use_cache:
+                    ahead.update(await asyncio.to_thread(prefetch_cache, store, chunk))
+                # With require_crossref every DOI needs Crossref: fetch the window's misses in
+                # bulk (misses fall back to the per-DOI lookup). Otherwise Unpaywall covers
+                # most DOIs and Crossref is only asked for the rest.
+                if cfg.get("require_crossref", False):
+                    need = [d for d in dict.fromkeys(c.doi for c in chunk)
+                            if (ahead.get(d) or {}).get("crossref") is None]
+                    if need:
+                        try:
+                            found = await fetch_crossref_bulk(client, need)
+                            xref_bulk.update(found)
+                            log.info(f"Crossref bulk: {len(found)}/{len(need)} records")
+                        except Exception as e:
+                            log.warning(f"Crossref bulk lookup failed, falling back to per-DOI: {e}")
+
+            async def take(i: int, ctx: DoiCtx):
+                """ctx's prefetched cache entry and bulk Crossref record (None when absent)."""
+                async with load_lock:
+                    while i >= prefetched:
+                        await load_window()
+                return ahead.pop(ctx.doi, None), xref_bulk.pop(ctx.doi.lower(), None)
 
             # ------ Stage 1: prepare+download (bounded concurrency), staged into downloads/ ------
-            async def prep_wrapped(doi):
-                async with sem:
-                    return await prepare_one(doi, cfg, api_client, pdf_client, out_dir)
-
-            prep_tasks = [prep_wrapped(doi) for doi in chunk]
-            rows = await tqdm_asyncio.gather(*prep_tasks, total=len(prep_tasks), desc="Stage 1: prepare+download")
-
-            # ------ Stage 2: processing (no network; only CPU and file moves) ------
-            log.info(f"Batch {start//batch_size + 1}: processing PDFs")
-            await process_batch_pdfs(rows, cfg, out_dir)
-
-            all_rows.extend(rows)
-
-            # optional: write incremental report after each batch
-            if cfg.get("write_after_each_batch", True):
-                out_df = pd.DataFrame(all_rows)
-                out_df.to_excel(out_dir / "report.xlsx", index=False)
-                out_df.to_csv(out_dir / "report.csv", index=False, encoding="utf-8")
-                log.info(f"Incremental report written: {len(out_df)} rows")
-
-    # final report
-    out_df = pd.DataFrame(all_rows)
-    out_df.to_excel(out_dir / "report.xlsx", index=False)
-    out_df.to_csv(out_dir / "report.csv", index=False, encoding="utf-8")
+            async def producer():
+                for i, ctx in pending:
+                    entry, xref = await take(i, ctx)
+                    row = await prepare_one(ctx, cfg, client, out_dir, store, xref, entry)
+                    await queue.put((i, ctx, row, entry))
+
+            async def stage1():
+                await gather_or_cancel(*(producer() for _ in range(concurrency)))
+                for _ in range(n_workers):
+                    await queue.put(None)
+
+            # ------ Stage 2: processing (CPU in the pool, file moves here) ------
+            async def consumer():
+                nonlocal done
+                while (item := await queue.get()) is not None:
+                    i, ctx, row, entry = item
+                    await process_pdf(ctx, row, cfg, out_dir, store, pool, entry)
+                    results[i] = row
+                    unflushed.append(row)
+                    done += 1
+                    progress.update(1)
+                    # optional: checkpoint report.csv every batch_size finished rows
+                    if cfg.get("write_after_each_batch", True) and done % batch_size == 0:
+                        pd.DataFrame(unflushed).to_csv(report_csv, mode="a", header=not report_csv.exists(),
+                                                       index=False, encoding="utf-8")
+                        unflushed.clear()
+                        await asyncio.to_thread(store.flush)
+                        log.info(f"Incremental report written: {done} rows")
+
+            # a failing stage cancels the other: no producer keeps downloading into a
+            # queue nobody reads, no consumer waits forever for the end-of-input marker
+            await gather_or_cancel(stage1(), *(consumer() for _ in range(n_workers)))
+    except BaseException:
+        log.error(f"Run failed after {done} rows; writing the finished rows")
+        write_report()
+        raise
+    finally:
+        progress.close()
+        pool.shutdown()
+        store.close()
+
+    out_df = write_report()
     log.info(f"Done. Total rows: {len(out_df)} → {out_dir/'report.xlsx'}")
     return out_df
 
@@ -1,5 +1,9 @@
 from pathlib import Path
-import json, pathlib, re
+import functools, hashlib, orjson, pathlib, re, sqlite3, threading, time
+
+_SANITIZE_RE = re.compile(r"[^A-Za-z0-9._-]+")
+# per-DOI record namespaces of the JSON cache layout (migrated into CacheStore)
+JSON_NAMESPACES = ("crossref", "unpaywall", "matches")
 
 
 """
@@ -17,7 +21,7 @@ import json, pathlib, re
 """
 def cache_write(path: Path, data: dict) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    path.write_bytes(orjson.dumps(data))
 
 
 """
@@ -31,17 +35,17 @@ def cache_write(path: Path, data: dict) -> None:
               does not exist or cannot be decoded.
 """
 def cache_read(path: Path) -> dict:
-    if not path.exists():
-        return {}
+    # one open() instead of a stat() followed by open()
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
+        return orjson.loads(path.read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
         return {}
 
 
 """
     Construct the filesystem path for a cache entry given a base directory,
-    a namespace, and a DOI identifier.
+    a namespace, and a DOI identifier. Entries are sharded into 256 subdirectories
+    (like git's object store) so no directory grows past a few hundred files.
 
     Args:
         base (Path)
@@ -52,11 +56,16 @@ def cache_read(path: Path) -> dict:
         Path: Full Path where the cache entry should be stored (not guaranteed to exist yet).
 """
 def cache_path(base: pathlib.Path, ns: str, doi: str) -> pathlib.Path:
-    return base / "cache" / ns / f"{sanitize_doi(doi)}.json"
+    name = sanitize_filename(doi)
+    return base / "cache" / ns / _shard(name) / f"{name}.json"
+
+# shard of a cache entry, derived from its file name
+def _shard(name: str) -> str:
+    return hashlib.blake2b(name.encode(), digest_size=1).hexdigest()
 
 
 """
-    Sanitize a doi to make it safe for url.
+    Sanitize a doi to make it safe as a filename (and cache key).
 
     Args:
         s (str)
@@ -64,6 +73,161 @@ def cache_path(base: pathlib.Path, ns: str, doi: str) -> pathlib.Path:
     Returns:
         str: Sanitized filename-safe version of the input, with invalid characters replaced by underscores.
 """
-def sanitize_doi(s: str) -> str:
-    s = s.strip().replace("doi:", "").replace("DOI:", "")
-    return re.sub(r"[^A-Za-z0-9._-]+", "_", s)
+@functools.lru_cache(maxsize=1 << 16)  # pure; called for every cache key and download path of a DOI
+def sanitize_filename(s: str) -> str:
+    return _SANITIZE_RE.sub("_", s.strip().removeprefix("doi:").removeprefix("DOI:"))
+
+
+"""
+    Single-file SQLite cache for every namespace (crossref, unpaywall, matches), replacing
+    one JSON file per DOI and namespace: one file descriptor instead of thousands of inodes,
+    and atomic, transactional writes. Entries are keyed by the sanitized DOI, like the JSON
+    cache filenames, and stored as orjson-encoded blobs. Writes are grouped into one
+    transaction per `flush_every` puts (or an explicit flush()/close()), not one commit each.
+
+    Args:
+        db_path (Path)
+        flush_every (int, optional)
+
+    Side Effects:
+        Creates the database (WAL journal, synchronous=NORMAL) and its parent directories.
+"""
+class CacheStore:
+    def __init__(self, db_path: Path, flush_every: int = 256):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # shared by the event loop and worker threads (asyncio.to_thread): every use of the
+        # connection and the pending counter goes through self._lock
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " ns TEXT NOT NULL, doi TEXT NOT NULL, payload BLOB NOT NULL, updated_at INTEGER NOT NULL,"
+            " PRIMARY KEY (ns, doi))"
+        )
+        self.conn.commit()
+        self.flush_every = flush_every
+        self._pending = 0
+
+    def get(self, doi: str, ns: str) -> dict:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT payload FROM cache WHERE ns = ? AND doi = ?", (ns, sanitize_filename(doi))
+            ).fetchone()
+        if row is None:
+            return {}
+        try:
+            return orjson.loads(row[0])
+        except orjson.JSONDecodeError:
+            return {}
+
+    # {doi: data} for the cached DOIs among `dois` (misses are absent), one query per 500 keys
+    def get_many(self, dois: list, ns: str) -> dict:
+        keys = {sanitize_filename(d): d for d in dois}
+        found = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), 500):
+            chunk = key_list[i:i + 500]
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT doi, payload FROM cache WHERE ns = ? AND doi IN ({','.join('?' * len(chunk))})",
+                    (ns, *chunk),
+                ).fetchall()
+            for key, payload in rows:
+                try:
+                    found[keys[key]] = orjson.loads(payload)
+                except orjson.JSONDecodeError:
+                    pass
+        return found
+
+    def put(self, doi: str, ns: str, data: dict) -> None:
+        payload = orjson.dumps(data)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (ns, doi, payload, updated_at) VALUES (?, ?, ?, ?)",
+                (ns, sanitize_filename(doi), payload, int(time.time())),
+            )
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self.flush()
+
+    # one executemany for {doi: data}; counts toward flush_every like as many put() calls
+    def put_many(self, items: dict, ns: str) -> None:
+        now = int(time.time())
+        rows = [(ns, sanitize_filename(doi), orjson.dumps(data), now) for doi, data in items.items()]
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cache (ns, doi, payload, updated_at) VALUES (?, ?, ?, ?)", rows
+            )
+            self._pending += len(rows)
+            if self._pending >= self.flush_every:
+                self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self.conn.close()
+
+    def __enter__(self) -> "CacheStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+"""
+    Open the SQLite cache under base/cache/. Per-DOI JSON entries (base/cache/<ns>/**/*.json)
+    whose keys the store doesn't hold yet are imported on every open, so JSON written after
+    the database was created (older versions of the batch script) is not lost.
+
+    Args:
+        base (Path)
+
+    Returns:
+        CacheStore: Open store; close it (or use it as a context manager) when done.
+"""
+def open_cache_store(base: Path) -> CacheStore:
+    store = CacheStore(base / "cache" / "cache.sqlite3")
+    migrate_json_cache(base, store)
+    return store
+
+
+"""
+    Import the JSON cache files under base/cache/<ns>/, sharded or flat (for the per-DOI
+    namespaces in JSON_NAMESPACES), into the store in one transaction. Keys the store
+    already holds are skipped without reading the file, and never overwritten.
+    Unreadable files are skipped; the JSON files themselves are left in place.
+
+    Args:
+        base (Path)
+        store (CacheStore)
+
+    Returns:
+        int: Number of entries imported.
+"""
+def migrate_json_cache(base: Path, store: CacheStore) -> int:
+    now = int(time.time())
+    rows = []
+    for ns in JSON_NAMESPACES:
+        ns_dir = base / "cache" / ns
+        if not ns_dir.is_dir():
+            continue
+        with store._lock:
+            known = {k for (k,) in store.conn.execute("SELECT doi FROM cache WHERE ns = ?", (ns,))}
+        for f in ns_dir.rglob("*.json"):
+            if f.stem in known:
+                continue
+            data = cache_read(f)
+            if data:
+                rows.append((ns_dir.name, f.stem, orjson.dumps(data), now))
+    with store._lock, store.conn:
+        store.conn.executemany(
+            "INSERT OR IGNORE INTO cache (ns, doi, payload, updated_at) VALUES (?, ?, ?, ?)", rows
+        )
+    return len(rows)
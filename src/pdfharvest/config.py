@@ -11,6 +11,11 @@ class AppConfig:
     input_excel: Path = Path("doi_data_pite_2025.xlsx")
     doi_column: str = "doi"
     strings: List[str] = field(default_factory=list)
+    search: Dict[str, Any] = field(default_factory=lambda: {
+        "want_all_pages": False,
+        "stop_on_first_match": False,
+        "bytes_prefilter": False,
+    })
     batch_size: int = 5
     concurrency: int = 5
     folders: Dict[str, str] = field(default_factory=lambda: {
@@ -23,7 +28,11 @@ class AppConfig:
     http: Dict[str, Any] = field(default_factory=lambda: {
         "user_agent": "doi-harvest/2.0 (mailto:someone@example.com)",
         "max_keepalive": 20,
-        "max_connections": 20
+        "max_connections": 20,
+        "api_max_keepalive": 20,
+        "api_max_connections": 50,
+        "pdf_max_keepalive": 5,
+        "pdf_max_connections": 20
     })
     write_after_each_batch: bool = True
     logging: Dict[str, Any] = field(default_factory=lambda: {
@@ -53,6 +62,7 @@ def load_config(path: str | Path) -> AppConfig:
         input_excel=Path(data.get("input_excel", data.get("doi_input", "doi_data_pite_2025.xlsx"))),
         doi_column=data.get("doi_column", "doi"),
         strings=data.get("strings", []) or [],
+        search={**AppConfig().search, **(data.get("search") or {})},
         batch_size=int(data.get("batch_size", 5)),
         concurrency=int(data.get("concurrency", 5)),
         folders=data.get("folders", cfg_default := AppConfig().folders),
@@ -29,6 +29,10 @@ def setup_logging(cfg: Dict[str, Any], out_dir: Path):
     )
 
     fmt = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+    # the format uses none of these: skip collecting them for every record
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
     logging.basicConfig(level=level, format=fmt, handlers=[handler, logging.StreamHandler()])
     logging.getLogger("httpx").setLevel(logging.WARNING)
     return logging.getLogger("harvest")
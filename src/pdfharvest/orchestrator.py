@@ -1,13 +1,127 @@
 from __future__ import annotations
-import asyncio, logging
+import asyncio, atexit, csv, functools, hashlib, logging, os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 import pandas as pd
 import httpx
 
-from pdfharvest.http import fetch_crossref, fetch_unpaywall, best_pdf_url, download_pdf
-from pdfharvest.pdfops import search_pdf, move_pdf_atomic
-from pdfharvest.cache import cache_path, cache_read, cache_write, sanitize_doi
+try:  # optional: pip install pdfharvest[calamine] (Rust xlsx reader, much faster than openpyxl)
+    import python_calamine  # noqa: F401
+    _EXCEL_ENGINE = "calamine"
+except ImportError:
+    _EXCEL_ENGINE = None  # pandas' default, openpyxl
+
+from pdfharvest.http import AdaptiveLimit, fetch_crossref, fetch_crossref_bulk, fetch_unpaywall, best_pdf_url, download_pdf, make_client
+from pdfharvest.pdfops import prepare_needles, search_pdf, move_pdf_atomic
+from pdfharvest.cache import CacheStore, cache_path, cache_read, cache_write, open_cache_store, sanitize_filename
+
+# report.csv / report.xlsx column order (the keys of a prepare_one row)
+REPORT_COLUMNS = (
+    "doi", "title", "journal", "authors", "year", "is_oa", "pdf_url",
+    "pdf_temp_path", "pdf_final_path", "match_found", "matched_strings", "match_pages",
+)
+
+# config.yaml `search:` switches, passed to search_pdf as keyword arguments
+SEARCH_OPTIONS = ("want_all_pages", "stop_on_first_match", "bytes_prefilter")
+
+
+def _join(values) -> str:
+    return "; ".join(values) if values else ""
+
+def _authors(meta: Dict[str, Any]) -> str:
+    return "; ".join(f"{a.get('given','')} {a.get('family','')}".strip() for a in (meta.get("author") or []))
+
+def _year(meta: Dict[str, Any]):
+    parts = ((meta.get("issued") or {}).get("date-parts") or [[None]])[0]
+    return parts[0] if parts else None
+
+# report columns taken from the Crossref record: (column, extractor)
+_FIELDS = (
+    ("title", lambda meta: _join(meta.get("title"))),
+    ("journal", lambda meta: _join(meta.get("container-title"))),
+    ("authors", _authors),
+    ("year", _year),
+)
+
+
+# worker processes for search_pdf, started on first use and kept for the life of the
+# interpreter, so later runs in the same process reuse warm workers
+_POOL: Optional[ProcessPoolExecutor] = None
+
+# `broken`: a pool that raised BrokenProcessPool (a worker crashed in MuPDF or was
+# OOM-killed); it is replaced unless a concurrent caller already did so
+def _search_pool(broken: Optional[ProcessPoolExecutor] = None) -> ProcessPoolExecutor:
+    global _POOL
+    if _POOL is not None and _POOL is broken:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+    if _POOL is None:
+        _POOL = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _POOL
+
+@atexit.register
+def _shutdown_search_pool() -> None:
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+
+
+"""
+    Run search_pdf in the worker pool. If the pool breaks, it is rebuilt and the PDF is
+    retried once. If the fresh pool breaks too the search failed: which PDF crashed it is
+    unknown (every search in flight sees the same error), so none of them gets a verdict.
+
+    Args:
+        pdf_path (Path)
+        needles (tuple[str]): Output of prepare_needles.
+        options (dict): search_pdf keyword arguments, from _search_options.
+
+    Returns:
+        dict | None: search_pdf's result, or None when the search failed.
+"""
+async def _search(pdf_path: Path, needles: tuple, options: Dict[str, bool]) -> Optional[Dict[str, Any]]:
+    loop = asyncio.get_running_loop()
+    pool = _search_pool()
+    for attempt in range(2):
+        try:
+            return await loop.run_in_executor(
+                pool, functools.partial(search_pdf, pdf_path, needles, casefolded=True, **options))
+        except BrokenProcessPool:
+            logging.getLogger("pdfharvest.orchestrator").warning(
+                "Search worker crashed on %s (attempt %d); restarting the pool", pdf_path, attempt + 1)
+            pool = _search_pool(broken=pool)
+    return None
+
+def _search_options(cfg: Any) -> Dict[str, bool]:
+    search = getattr(cfg, "search", None) or {}
+    return {k: bool(search.get(k, False)) for k in SEARCH_OPTIONS}
+
+
+"""
+    Return the cached record for a DOI, or fetch it and cache the result.
+
+    Args:
+        store (CacheStore)
+        doi (str)
+        ns (str)
+        fetch (callable): Zero-argument coroutine factory performing the network fetch.
+        cached (dict | None, optional): Preloaded cache hits by namespace; when given,
+                                        the store is not queried again.
+
+    Returns:
+        dict: Cached or freshly fetched record.
+"""
+async def _cached_or_fetch(
+    store: CacheStore, doi: str, ns: str, fetch, cached: Dict[str, Any] | None = None
+) -> Dict[str, Any]:
+    # store I/O runs in a worker thread: a commit that waits on the disk must not stall
+    # the other DOIs' HTTP traffic
+    data = cached.get(ns) if cached is not None else await asyncio.to_thread(store.get, doi, ns)
+    if not data:
+        data = await fetch()
+        await asyncio.to_thread(store.put, doi, ns, data)
+    return data
 
 
 """
@@ -19,7 +133,10 @@ from pdfharvest.cache import cache_path, cache_read, cache_write, sanitize_doi
         api_client (httpx.AsyncClient)
         pdf_client (httpx.AsyncClient)
         out_dir (Path)
+        store (CacheStore)
         dry_run (bool, optional)
+        cached (dict | None, optional): This DOI's preloaded cache entries by namespace
+                                        (see run_batch); None looks them up in the store.
 
     Returns:
         dict: Processed record containing DOI metadata, file paths, and match results.
@@ -30,50 +147,34 @@ async def prepare_one(
     api_client: httpx.AsyncClient,
     pdf_client: httpx.AsyncClient,
     out_dir: Path,
-    dry_run: bool = False
+    store: CacheStore,
+    dry_run: bool = False,
+    cached: Dict[str, Any] | None = None,
 ) -> Dict[str, Any]:
     log = logging.getLogger("pdfharvest.orchestrator")
     downloads = out_dir / cfg.folders["downloads"] if hasattr(cfg, "folders") else out_dir / "downloads"
-    downloads.mkdir(parents=True, exist_ok=True)
 
-    crossref_cache = cache_path(out_dir, "crossref", doi)
-    unpaywall_cache = cache_path(out_dir, "unpaywall", doi)
-
-    meta = cache_read(crossref_cache)
-    if not meta:
-        meta = await fetch_crossref(api_client, doi)
-        cache_write(crossref_cache, meta)
-
-    oa = cache_read(unpaywall_cache)
-    if not oa:
-        oa = await fetch_unpaywall(api_client, doi, cfg.email)
-        cache_write(unpaywall_cache, oa)
+    # the two APIs are independent: fetch them concurrently
+    meta, oa = await asyncio.gather(
+        _cached_or_fetch(store, doi, "crossref", lambda: fetch_crossref(api_client, doi), cached),
+        _cached_or_fetch(store, doi, "unpaywall", lambda: fetch_unpaywall(api_client, doi, cfg.email), cached),
+    )
 
     pdf_url = best_pdf_url(oa)
     temp_pdf = ""
 
     if pdf_url:
-        out_path = downloads / f"{sanitize_doi(doi)}.pdf"
+        out_path = downloads / f"{sanitize_filename(doi)}.pdf"
         if not dry_run:
             ok = await download_pdf(pdf_client, pdf_url, out_path)
             if ok:
                 temp_pdf = str(out_path)
         else:
-            log.info(f"[dry-run] Skipping download for {doi}")
-
-    title = "; ".join(meta.get("title", [])) if meta.get("title") else ""
-    journal = "; ".join(meta.get("container-title", [])) if meta.get("container-title") else ""
-    authors = "; ".join(
-        f"{a.get('given','')} {a.get('family','')}".strip()
-        for a in (meta.get("author", []) or [])
-    )
+            log.info("[dry-run] Skipping download for %s", doi)
 
     return {
         "doi": doi,
-        "title": title,
-        "journal": journal,
-        "authors": authors,
-        "year": (meta.get("issued", {}).get("date-parts", [[None]])[0][0]) if meta.get("issued") else None,
+        **{column: extract(meta) for column, extract in _FIELDS},
         "is_oa": oa.get("is_oa", None),
         "pdf_url": pdf_url or "",
         "pdf_temp_path": temp_pdf,
@@ -84,6 +185,39 @@ async def prepare_one(
     }
 
 
+"""
+    Run prepare_one under the (adaptive) concurrency limit, then hand a downloaded PDF to the
+    process pool right away so it is searched while the rest of the batch downloads.
+
+    Args:
+        sem (AdaptiveLimit)
+        doi, cfg, api_client, pdf_client, out_dir, store, dry_run, cached: As for prepare_one.
+        needles (tuple[str]): Output of prepare_needles.
+
+    Returns:
+        tuple: (row, pending search_pdf result or None)
+"""
+async def _prep_limited(
+    sem: AdaptiveLimit,
+    doi: str,
+    cfg: Any,
+    api_client: httpx.AsyncClient,
+    pdf_client: httpx.AsyncClient,
+    out_dir: Path,
+    store: CacheStore,
+    dry_run: bool,
+    cached: Dict[str, Any] | None,
+    needles: tuple,
+):
+    async with sem:
+        row = await prepare_one(doi, cfg, api_client, pdf_client, out_dir, store,
+                                dry_run=dry_run, cached=cached)
+    search = None
+    if not dry_run and row["pdf_temp_path"]:
+        search = asyncio.ensure_future(_search(Path(row["pdf_temp_path"]), needles, _search_options(cfg)))
+    return row, search
+
+
 """
     Process a list of PDF download tasks (a single batch): download, validate and move to final location.
 
@@ -93,34 +227,101 @@ async def prepare_one(
         out_dir (Path)
         concurrency (int, optional)
         validate_pdf (Callable[[Path], bool], optional)
+        searches (list[Awaitable | None], optional): search_pdf results already started
+                                                     for rows[i] (see run_batch); rows without
+                                                     one are submitted to the search pool here.
 
     Returns:
         list[dict]: List of updated task dictionaries with download status and any error messages added under keys like 'download_ok' and 'download_error'.
 """
 
-async def process_batch_pdfs(rows: List[Dict[str, Any]], cfg: Any, out_dir: Path):
+async def process_batch_pdfs(
+    rows: List[Dict[str, Any]],
+    cfg: Any,
+    out_dir: Path,
+    searches: Optional[List[Any]] = None,
+):
     log = logging.getLogger("pdfharvest.orchestrator")
-    needles = getattr(cfg, "strings", [])
+    needles = prepare_needles(getattr(cfg, "strings", []))
     found_dir = out_dir / cfg.folders["found"] if hasattr(cfg, "folders") else out_dir / "output_found"
     notfound_dir = out_dir / cfg.folders["notfound"] if hasattr(cfg, "folders") else out_dir / "output_notfound"
 
-    for r in rows:
+    moves = []
+    for i, r in enumerate(rows):
         if not r.get("pdf_temp_path"):
             continue
 
         pdf_path = Path(r["pdf_temp_path"])
-        result = search_pdf(pdf_path, needles)
+        search = searches[i] if searches else None
+        if search is None:
+            search = _search(pdf_path, needles, _search_options(cfg))
+        result = await search
+        if result is None:
+            # no verdict: leave the PDF in downloads/ and the row unfiled (so not "done"),
+            # the next run searches it again
+            log.warning("Search failed for %s; left in %s", r.get("doi"), pdf_path.parent)
+            continue
 
         r["match_found"] = result["found"]
         r["matched_strings"] = ", ".join(result["matches"])
         r["match_pages"] = ", ".join(map(str, result["pages"]))
 
         dest_dir = found_dir if result["found"] else notfound_dir
-        final_path = move_pdf_atomic(pdf_path, dest_dir)
+        moves.append((r, pdf_path, dest_dir))
+
+    # moves may turn into copies across filesystems: run them off the loop, all at once
+    finals = await asyncio.gather(*(asyncio.to_thread(move_pdf_atomic, p, d) for _, p, d in moves))
+    for (r, _, _), final_path in zip(moves, finals):
         r["pdf_final_path"] = str(final_path)
 
 
 
+# bump when _read_dois parses differently, so lists cached by older code are not reused
+_DOIS_CACHE_VERSION = 1
+
+
+"""
+    Read the DOI column of the input workbook. The parsed list is cached under
+    out_dir/cache/dois/, keyed by a blake2b digest of the parser version, the file's bytes
+    and the column name, so unchanged inputs skip the Excel parse on later runs.
+
+    Args:
+        input_excel (Path)
+        doi_col (str)
+        out_dir (Path)
+        use_cache (bool, optional): cache.enabled; False neither reads nor writes the cache.
+        refresh (bool, optional): cache.force_refresh; re-parse and overwrite the cached list.
+
+    Returns:
+        list[str]: Stripped DOIs in sheet order (duplicates kept).
+
+    Raises:
+        ValueError: If the first sheet has no such column.
+"""
+def _read_dois(input_excel: Path, doi_col: str, out_dir: Path,
+               use_cache: bool = True, refresh: bool = False) -> List[str]:
+    cached = None
+    if use_cache:
+        digest = hashlib.blake2b(f"v{_DOIS_CACHE_VERSION}\0".encode(), digest_size=16)
+        digest.update(input_excel.read_bytes())
+        digest.update(doi_col.encode())
+        cached = cache_path(out_dir, "dois", digest.hexdigest())
+        data = {} if refresh else cache_read(cached)
+        if "dois" in data:
+            return data["dois"]
+
+    # parse only the DOI column, as strings (no type inference); a callable usecols lets a
+    # missing column fall through to our error
+    df = pd.read_excel(input_excel, sheet_name=0, engine=_EXCEL_ENGINE,
+                       usecols=lambda c: c == doi_col, dtype={doi_col: "string"})
+    if doi_col not in df.columns:
+        raise ValueError(f"Excel must contain column '{doi_col}'")
+    dois = df[doi_col].dropna().str.strip().tolist()
+    if cached is not None:
+        cache_write(cached, {"dois": dois})
+    return dois
+
+
 """
     Process all DOIs in batches asynchronously, coordinating downloads and metadata extraction.
 
@@ -135,52 +336,111 @@ async def run_batch(cfg: Any, dry_run: bool = False):
     log = logging.getLogger("pdfharvest.orchestrator")
     out_dir = Path(cfg.output_dir) if hasattr(cfg, "output_dir") else Path("output")
     out_dir.mkdir(parents=True, exist_ok=True)
-
-    df = pd.read_excel(cfg.input_excel)
-    doi_col = getattr(cfg, "doi_column", "doi")
-    if doi_col not in df.columns:
-        raise ValueError(f"Excel must contain column '{doi_col}'")
-    dois = [str(x).strip() for x in df[doi_col].dropna().tolist()]
+    # created once here, not per DOI in prepare_one
+    (out_dir / cfg.folders["downloads"] if hasattr(cfg, "folders") else out_dir / "downloads").mkdir(parents=True, exist_ok=True)
+
+    cache_cfg = getattr(cfg, "cache", None) or {}
+    refresh = bool(cache_cfg.get("force_refresh", False))
+    dois = _read_dois(Path(cfg.input_excel), getattr(cfg, "doi_column", "doi"), out_dir,
+                      use_cache=bool(cache_cfg.get("enabled", True)), refresh=refresh)
+    # DOIs are case-insensitive: deduplicate on the folded DOI, since duplicates would cost
+    # the same API calls twice and race for the same cache entries; the first spelling is
+    # kept as-is, so cache keys (which keep case) from earlier runs still match
+    first: Dict[str, str] = {}
+    for d in dois:
+        if d:
+            first.setdefault(d.lower(), d)
+    dois = list(first.values())
 
     batch_size = getattr(cfg, "batch_size", 5)
+    needles = prepare_needles(getattr(cfg, "strings", []))  # casefolded once, not per PDF
     all_rows: List[Dict[str, Any]] = []
 
-    limits = httpx.Limits(
-        max_keepalive_connections=int(cfg.http.get("max_keepalive", 10)) if getattr(cfg, "http", None) else 10,
-        max_connections=int(cfg.http.get("max_connections", 10)) if getattr(cfg, "http", None) else 10,
+    http_cfg = getattr(cfg, "http", None) or {}
+    # Crossref/Unpaywall: few hosts, many requests -> HTTP/2 multiplexing and a big keepalive pool
+    api_limits = httpx.Limits(
+        max_keepalive_connections=int(http_cfg.get("api_max_keepalive", 20)),
+        max_connections=int(http_cfg.get("api_max_connections", 50)),
+        keepalive_expiry=60.0,
+    )
+    # publisher hosts mostly speak HTTP/1.1 only and are rarely hit twice: a small,
+    # short-lived keepalive pool, one connection per in-flight download
+    pdf_limits = httpx.Limits(
+        max_keepalive_connections=int(http_cfg.get("pdf_max_keepalive", 5)),
+        max_connections=int(http_cfg.get("pdf_max_connections", 20)),
+        keepalive_expiry=30.0,
     )
+    # one for the whole run, never above what the PDF pool can serve;
+    # shrinks while the APIs answer 429 and recovers after
+    sem = AdaptiveLimit(min(pdf_limits.max_connections, getattr(cfg, "concurrency", 5)))
     timeout = httpx.Timeout(float(cfg.timeouts.get("read", 20.0)), connect=float(cfg.timeouts.get("connect", 10.0)))
-
-    async with httpx.AsyncClient(limits=limits, timeout=timeout) as api_client, \
-               httpx.AsyncClient(limits=limits, timeout=timeout) as pdf_client:
-
-        for start in range(0, len(dois), batch_size):
-            batch = dois[start:start + batch_size]
-            log.info(f"Processing batch {start // batch_size + 1} with {len(batch)} DOIs")
-
-            sem = asyncio.Semaphore(getattr(cfg, "concurrency", 5))
-
-            async def prep_limited(doi):
-                async with sem:
-                    return await prepare_one(doi, cfg, api_client, pdf_client, out_dir, dry_run=dry_run)
-
-            rows = await asyncio.gather(*[prep_limited(doi) for doi in batch])
-
-            if not dry_run:
-                await asyncio.to_thread(lambda: None) 
-                await process_batch_pdfs(rows, cfg, out_dir)
-
-            all_rows.extend(rows)
-
-            if getattr(cfg, "write_after_each_batch", True):
-                out_df = pd.DataFrame(all_rows)
-                out_df.to_excel(out_dir / "report.xlsx", index=False)
-                out_df.to_csv(out_dir / "report.csv", index=False, encoding="utf-8")
-                log.info(f"Incremental report written: {len(out_df)} rows")
-
-    out_df = pd.DataFrame(all_rows)
-    out_df.to_excel(out_dir / "report.xlsx", index=False)
-    out_df.to_csv(out_dir / "report.csv", index=False, encoding="utf-8")
-    log.info(f"Done. Total DOIs processed: {len(all_rows)}")
+    # a mailto in the User-Agent puts us in Crossref's polite pool
+    email = getattr(cfg, "email", "")
+    headers = {"User-Agent": f"pdfharvest (mailto:{email})" if email else http_cfg.get("user_agent", "pdfharvest")}
+
+    # report.csv grows by one batch at a time; report.xlsx is written once, at the end
+    with open_cache_store(out_dir) as store, \
+         (out_dir / "report.csv").open("w", newline="", encoding="utf-8") as report:
+        writer = csv.DictWriter(report, fieldnames=REPORT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        async with make_client(api_limits, timeout, http2=True, headers=headers,
+                               event_hooks={"response": [sem.observe]}) as api_client, \
+                   make_client(pdf_limits, timeout, headers=headers) as pdf_client:
+
+            for start in range(0, len(dois), batch_size):
+                batch = dois[start:start + batch_size]
+                log.info("Processing batch %d with %d DOIs", start // batch_size + 1, len(batch))
+
+                # one bulk cache read per namespace instead of two lookups per DOI
+                preloaded = await asyncio.to_thread(
+                    lambda: {ns: store.get_many(batch, ns) for ns in ("crossref", "unpaywall", "done")}
+                )
+                # DOIs whose PDF a previous run already filed are reported as they were, with no HTTP
+                finished = {} if refresh else {
+                    doi: row for doi, row in preloaded.pop("done").items()
+                    if row.get("pdf_final_path") and Path(row["pdf_final_path"]).exists()
+                }
+                todo = [doi for doi in batch if doi not in finished]
+                cached = {doi: {ns: preloaded[ns].get(doi) for ns in ("crossref", "unpaywall")} for doi in todo}
+
+                # Crossref answers many DOIs per request: fetch the batch's misses in bulk;
+                # whatever it doesn't return falls back to the per-DOI lookup in prepare_one
+                missing = [doi for doi in todo if not cached[doi]["crossref"]]
+                if missing:
+                    bulk = await fetch_crossref_bulk(api_client, missing, email)
+                    hits = {doi: bulk[doi.lower()] for doi in missing if bulk.get(doi.lower())}
+                    for doi, meta in hits.items():
+                        cached[doi]["crossref"] = meta
+                    if hits:
+                        await asyncio.to_thread(store.put_many, hits, "crossref")
+
+                prepared = await asyncio.gather(*[
+                    _prep_limited(sem, doi, cfg, api_client, pdf_client, out_dir, store,
+                                  dry_run, cached[doi], needles)
+                    for doi in todo
+                ])
+                fresh = [row for row, _ in prepared]
+
+                if not dry_run:
+                    await process_batch_pdfs(fresh, cfg, out_dir, [search for _, search in prepared])
+                    filed = {r["doi"]: r for r in fresh if r["pdf_final_path"]}
+                    if filed:
+                        await asyncio.to_thread(store.put_many, filed, "done")
+
+                it = iter(fresh)
+                rows = [finished[doi] if doi in finished else next(it) for doi in batch]
+
+                all_rows.extend(rows)
+
+                writer.writerows(rows)
+                await asyncio.to_thread(store.flush)  # the cache is durable up to every row in the report
+                if getattr(cfg, "write_after_each_batch", True):
+                    report.flush()
+                    log.info("Incremental report written: %d rows", len(all_rows))
+
+    pd.DataFrame(all_rows, columns=list(REPORT_COLUMNS)).to_excel(
+        out_dir / "report.xlsx", index=False, engine="xlsxwriter"
+    )
+    log.info("Done. Total DOIs processed: %d", len(all_rows))
     return all_rows
 
@@ -1,49 +1,157 @@
 from pathlib import Path
-import pathlib, logging, shutil
-from pypdf import PdfReader 
+import contextlib, errno, functools, mmap, os, pathlib, logging, shutil
+import pymupdf
 from typing import Dict, Any, List
 
-def search_pdf(pdf_path: pathlib.Path, needles: List[str]) -> Dict[str, Any]:
+try:  # optional C extension (pip install pdfharvest[fast]): one pass per page for all needles
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+@functools.lru_cache(maxsize=8)
+def _automaton(ns: tuple):
+    """
+    Aho-Corasick automaton over the casefolded needles, built once per needle set
+    (and per worker process); None when pyahocorasick isn't installed.
+    """
+    if ahocorasick is None or not ns:
+        return None
+    A = ahocorasick.Automaton()
+    for n in ns:
+        if n:
+            A.add_word(n, n)
+    A.make_automaton()
+    return A
+
+def prepare_needles(needles: List[str]) -> tuple:
+    """
+    Casefolded, de-duplicated needles in their original order. Compute once per run and
+    pass to search_pdf with casefolded=True instead of casefolding again for every PDF.
+    """
+    return tuple(dict.fromkeys(n.casefold() for n in needles))
+
+@functools.lru_cache(maxsize=8)
+def _needle_bytes(ns: tuple) -> tuple:
+    """UTF-8 and Latin-1 encodings of each casefolded needle, for the raw-bytes prefilter."""
+    out = set()
+    for n in ns:
+        out.add(n.encode("utf-8"))
+        with contextlib.suppress(UnicodeEncodeError):
+            out.add(n.encode("latin-1"))
+    return tuple(out)
+
+def _bytes_prefilter_miss(pdf_path: pathlib.Path, ns: tuple) -> bool:
+    """
+    Heuristic: True when no needle occurs in the raw file, so parsing can be skipped.
+    Only trusted for files without any stream /Filter (compressed text never matches);
+    text split by kerning arrays can still slip through, hence the opt-in toggle.
     """
-    Text search (casefolded substrings). If you need OCR later, add an opt-in pass here.
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm.find(b"/Filter") != -1:
+            return False
+        low = mm[:].lower()
+    return not any(nb in low for nb in _needle_bytes(ns))
+
+def search_pdf(
+    pdf_path: pathlib.Path, needles: List[str], want_all_pages: bool = False,
+    casefolded: bool = False, stop_on_first_match: bool = False, bytes_prefilter: bool = False,
+) -> Dict[str, Any]:
+    """
+    Text search (casefolded substrings) over PyMuPDF's C text extractor; each page is
+    scanned once for all needles when pyahocorasick is available.
+    Stops reading pages once every needle has matched, unless want_all_pages is set
+    (then "pages" lists every page with a match, not just those up to the last new one),
+    or at the first matching page with stop_on_first_match (enough for found/notfound routing).
+    bytes_prefilter skips parsing uncompressed files whose raw bytes contain no needle.
+    casefolded says needles already come from prepare_needles.
+    If you need OCR later, add an opt-in pass here.
     """
     res = {"found": False, "matches": [], "pages": []}
     try:
-        reader = PdfReader(str(pdf_path))
-        ns = [n.casefold() for n in needles]
-        hits, pages = set(), set()
-        for i, p in enumerate(reader.pages):
-            try:
-                txt = (p.extract_text() or "").casefold()
-            except Exception:
-                txt = ""
-            if not txt:
-                continue
-            page_hit = False
-            for n in ns:
-                if n in txt:
-                    hits.add(n); page_hit = True
-            if page_hit:
-                pages.add(i + 1)
+        ns = tuple(needles) if casefolded else prepare_needles(needles)
+        if bytes_prefilter and _bytes_prefilter_miss(pdf_path, ns):
+            return res
+        doc = pymupdf.open(str(pdf_path))
+        try:
+            automaton = _automaton(ns)
+            n_unique = len(set(ns))
+            hits, pages = set(), set()
+            for i, p in enumerate(doc):
+                try:
+                    txt = p.get_text("text").casefold()
+                except Exception:
+                    txt = ""
+                if not txt:
+                    continue
+                page_hit = False
+                if automaton is not None:
+                    for _, n in automaton.iter(txt):
+                        hits.add(n); page_hit = True
+                else:
+                    for n in ns:
+                        if n in txt:
+                            hits.add(n); page_hit = True
+                if page_hit:
+                    pages.add(i + 1)
+                    if stop_on_first_match or (len(hits) == n_unique and not want_all_pages):
+                        break
+        finally:
+            doc.close()
         if hits:
             res.update(found=True, matches=sorted(hits), pages=sorted(pages))
     except Exception as e:
-        logging.getLogger("harvest").warning(f"PDF parse failed {pdf_path}: {e}")
+        logging.getLogger("harvest").warning("PDF parse failed %s: %s", pdf_path, e)
     return res
 
+def _replace(src: pathlib.Path, target: pathlib.Path) -> pathlib.Path:
+    """
+    Rename src to target; across filesystems (EXDEV) copy to a temp name next to the
+    target (shutil.copyfile uses sendfile on Linux: no userspace copy), rename, drop src.
+    """
+    try:
+        return src.replace(target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp = target.with_name(target.name + ".part")
+    shutil.copyfile(src, tmp)
+    tmp.replace(target)
+    src.unlink()
+    return target
+
+def _claim(src: pathlib.Path, target: pathlib.Path) -> pathlib.Path:
+    """
+    Reserve target with an exclusive create (FileExistsError if the name is taken, also
+    by a concurrent move), then move src over the placeholder.
+    """
+    with open(target, "xb"):
+        pass
+    try:
+        return _replace(src, target)
+    except BaseException:
+        target.unlink(missing_ok=True)
+        raise
+
 def move_pdf_atomic(src: pathlib.Path, dst_dir: pathlib.Path) -> pathlib.Path:
     """
     Move a file atomically, preserving name; if collision, append a counter.
     """
     dst_dir.mkdir(parents=True, exist_ok=True)
-    target = dst_dir / src.name
-    if not target.exists():
-        return src.replace(target)
     stem, suf = src.stem, src.suffix
-    k = 1
+    cand = dst_dir / src.name
+    existing = None
+    k = 0
     while True:
-        cand = dst_dir / f"{stem}_{k}{suf}"
-        if not cand.exists():
-            return src.replace(cand)
+        try:
+            return _claim(src, cand)
+        except FileExistsError:
+            pass
+        # collisions only happen on reruns or sanitized-name clashes: list the
+        # directory once instead of stat()ing name_1, name_2, ... until one is free
+        if existing is None:
+            existing = {e.name for e in os.scandir(dst_dir)}
         k += 1
+        while f"{stem}_{k}{suf}" in existing:
+            k += 1
+        cand = dst_dir / f"{stem}_{k}{suf}"
 
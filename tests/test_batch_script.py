@@ -0,0 +1,207 @@
+# tests/test_batch_script.py
+import asyncio
+import json
+import pytest
+import httpx
+import pandas as pd
+import yaml
+from reportlab.pdfgen import canvas
+
+import core_pdf_scanner_batch as script
+
+
+def test_stream_dois_csv(tmp_path):
+    path = tmp_path / "in.csv"
+    path.write_text("doi,other\n 10.1/a ,x\n,y\n10.1/b,z\n", encoding="utf-8")
+
+    assert list(script._stream_dois(path, "doi")) == ["10.1/a", "10.1/b"]
+    with pytest.raises(ValueError):
+        list(script._stream_dois(path, "missing"))
+
+
+def test_stream_dois_xlsx_reads_first_sheet(tmp_path):
+    path = tmp_path / "in.xlsx"
+    with pd.ExcelWriter(path) as w:
+        pd.DataFrame({"other": [1, 2, 3], "doi": [" 10.1/a", None, "10.1/b "]}).to_excel(w, sheet_name="first", index=False)
+        pd.DataFrame({"doi": ["10.1/ignored"]}).to_excel(w, sheet_name="second", index=False)
+
+    assert list(script._stream_dois(path, "doi")) == ["10.1/a", "10.1/b"]
+
+
+def test_stream_dois_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "in.parquet"
+    pd.DataFrame({"doi": ["10.1/a", None, " ", "10.1/b"], "other": [1, 2, 3, 4]}).to_parquet(path)
+
+    assert list(script._stream_dois(path, "doi")) == ["10.1/a", "10.1/b"]
+
+
+def test_pdf_candidates_rank_direct_links_before_landing_pages():
+    ua = {
+        "best_oa_location": {"url": "https://best/landing", "url_for_pdf": None, "host_type": "repository"},
+        "oa_locations": [
+            {"url": "https://repo/landing", "url_for_pdf": "https://repo/x.pdf", "host_type": "repository"},
+            {"url": "https://pub/landing", "url_for_pdf": "https://pub/x.pdf", "host_type": "publisher"},
+        ],
+    }
+    assert list(script._pdf_candidates(ua)) == [
+        "https://pub/x.pdf", "https://repo/x.pdf",
+        "https://best/landing", "https://pub/landing", "https://repo/landing",
+    ]
+
+
+def test_best_pdf_url_skips_blocked_hosts_and_closed_access():
+    ua = {"is_oa": False, "oa_locations": [
+        {"url_for_pdf": "https://www.researchgate.net/x.pdf", "host_type": "repository"},
+        {"url_for_pdf": "https://repo/x.pdf", "host_type": "repository"},
+    ]}
+    assert script.best_pdf_url(ua) == "https://repo/x.pdf"
+    assert script.is_closed_access(ua) is True
+    ua["oa_locations"][1]["host_type"] = "publisher"
+    assert script.is_closed_access(ua) is False
+
+
+def test_search_pdf_honours_want_all_pages(tmp_path):
+    # same search: switches as pdfharvest, with the same meaning
+    path = tmp_path / "two_pages.pdf"
+    c = canvas.Canvas(str(path))
+    c.drawString(100, 750, "AGH University, IDUB")
+    c.showPage()
+    c.drawString(100, 750, "IDUB again")
+    c.save()
+    needles = ["AGH University", "IDUB"]
+
+    assert script.search_pdf(path, needles)["pages"] == [1]
+    assert script.search_pdf(path, needles, want_all_pages=True)["pages"] == [1, 2]
+    assert script.search_pdf(path, needles, want_all_pages=True, stop_on_first_match=True)["pages"] == [1]
+
+
+def _pdf_bytes(tmp_path, text):
+    path = tmp_path / "src.pdf"
+    c = canvas.Canvas(str(path))
+    c.drawString(100, 750, text)
+    c.save()
+    return path.read_bytes()
+
+
+@pytest.mark.asyncio
+async def test_run_end_to_end_with_stubbed_http(tmp_path, monkeypatch):
+    pdf = _pdf_bytes(tmp_path, "Funded by AGH University")
+    unpaywall = {
+        "10.1/a": {
+            "is_oa": True, "title": "Paper A", "journal_name": "Journal A", "year": 2024,
+            "z_authors": [{"given": "Ada", "family": "Lovelace"}], "publisher": "Pub A",
+            "genre": "journal-article", "doi_url": "https://doi.org/10.1/a",
+            "best_oa_location": {"url_for_pdf": "https://pub.example/a.pdf", "host_type": "publisher",
+                                 "license": "cc-by"},
+        },
+        "10.1/b": {"is_oa": False, "title": None, "oa_locations": []},
+    }
+    crossref = {"10.1/b": {"title": ["Paper B"], "publisher": "Pub B", "type": "book-chapter",
+                           "URL": "https://doi.org/10.1/b", "issued": {"date-parts": [[2020]]}}}
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "HEAD":
+            return httpx.Response(200)
+        seen.append(str(request.url))
+        doi = request.url.path.split("/", 2)[-1].removeprefix("works/")   # /v2/<doi>, /works/<doi>
+        if request.url.host == "api.unpaywall.org":
+            return httpx.Response(200, content=json.dumps(unpaywall[doi]))
+        if request.url.host == "api.crossref.org":
+            return httpx.Response(200, content=json.dumps({"message": crossref[doi]}))
+        if request.url.host == "pub.example":
+            return httpx.Response(200, content=pdf, headers={"Content-Type": "application/pdf"})
+        return httpx.Response(404)
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(script.httpx, "AsyncClient",
+                        lambda **kw: real_client(transport=httpx.MockTransport(handler),
+                                                 **{k: v for k, v in kw.items() if k != "http2"}))
+
+    (tmp_path / "in.csv").write_text("doi\n10.1/a\n10.1/b\n", encoding="utf-8")
+    cfg = yaml.safe_load(open("config.yaml", encoding="utf-8"))
+    cfg.update(input_excel=str(tmp_path / "in.csv"), output_dir=str(tmp_path / "out"),
+               batch_size=2, pdf_workers=1, strings=["AGH University", "IDUB"])
+    cfg["logging"] = {"level": "WARNING", "file": "harvest.log"}
+    (tmp_path / "cfg.yaml").write_text(yaml.safe_dump(cfg), encoding="utf-8")
+
+    df = await script.run(str(tmp_path / "cfg.yaml"))
+
+    a, b = df.to_dict("records")
+    # metadata for a comes from Unpaywall alone; b has no title there, so Crossref fills in
+    assert (a["title"], a["journal"], a["year"], a["authors"]) == ("Paper A", "Journal A", 2024, "Ada Lovelace")
+    assert (a["publisher"], a["type"], a["crossref_url"]) == ("Pub A", "journal-article", "https://doi.org/10.1/a")
+    assert (b["title"], b["publisher"], b["type"]) == ("Paper B", "Pub B", "book-chapter")
+    assert [u for u in seen if "api.crossref.org/works/" in u] == ["https://api.crossref.org/works/10.1/b"]
+    # a's PDF is downloaded, searched and filed; b is closed access, so nothing is fetched
+    assert a["match_found"] and a["matched_strings"] == "agh university"
+    assert a["pdf_final_path"].endswith("output_found/10.1_a.pdf")
+    assert b["pdf_url"] == "" and b["pdf_final_path"] == ""
+    assert (tmp_path / "out" / "report.xlsx").exists()
+    assert list(pd.read_csv(tmp_path / "out" / "report.csv")["doi"]) == ["10.1/a", "10.1/b"]
+
+
+@pytest.mark.asyncio
+async def test_run_prefetches_cache_one_window_at_a_time(tmp_path, monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "api.unpaywall.org" and request.method == "GET":
+            return httpx.Response(200, content=json.dumps({"is_oa": False, "title": "T"}))
+        return httpx.Response(200)
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(script.httpx, "AsyncClient",
+                        lambda **kw: real_client(transport=httpx.MockTransport(handler),
+                                                 **{k: v for k, v in kw.items() if k != "http2"}))
+    windows = []
+    real_prefetch = script.prefetch_cache
+    def recording_prefetch(store, ctxs):
+        windows.append(len(ctxs))
+        return real_prefetch(store, ctxs)
+    monkeypatch.setattr(script, "prefetch_cache", recording_prefetch)
+
+    (tmp_path / "in.csv").write_text("doi\n" + "".join(f"10.1/{i}\n" for i in range(20)), encoding="utf-8")
+    cfg = yaml.safe_load(open("config.yaml", encoding="utf-8"))
+    cfg.update(input_excel=str(tmp_path / "in.csv"), output_dir=str(tmp_path / "out"),
+               batch_size=1, concurrency=1, pdf_workers=1)
+    cfg["logging"] = {"level": "WARNING", "file": "harvest.log"}
+    (tmp_path / "cfg.yaml").write_text(yaml.safe_dump(cfg), encoding="utf-8")
+
+    df = await script.run(str(tmp_path / "cfg.yaml"))
+
+    assert len(df) == 20
+    assert windows == [8, 8, 4]
+
+
+@pytest.mark.asyncio
+async def test_run_failure_cancels_stages_and_keeps_finished_rows(tmp_path, monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "api.unpaywall.org" and request.method == "GET":
+            return httpx.Response(200, content=json.dumps({"is_oa": False, "title": "T"}))
+        return httpx.Response(200)
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(script.httpx, "AsyncClient",
+                        lambda **kw: real_client(transport=httpx.MockTransport(handler),
+                                                 **{k: v for k, v in kw.items() if k != "http2"}))
+    real_process = script.process_pdf
+    async def failing_process(ctx, *args, **kwargs):
+        if ctx.doi == "10.1/3":
+            raise RuntimeError("boom")
+        await real_process(ctx, *args, **kwargs)
+    monkeypatch.setattr(script, "process_pdf", failing_process)
+
+    (tmp_path / "in.csv").write_text("doi\n" + "".join(f"10.1/{i}\n" for i in range(20)), encoding="utf-8")
+    cfg = yaml.safe_load(open("config.yaml", encoding="utf-8"))
+    cfg.update(input_excel=str(tmp_path / "in.csv"), output_dir=str(tmp_path / "out"),
+               batch_size=1, concurrency=1, pdf_workers=1)
+    cfg["logging"] = {"level": "CRITICAL", "file": "harvest.log"}
+    (tmp_path / "cfg.yaml").write_text(yaml.safe_dump(cfg), encoding="utf-8")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        await script.run(str(tmp_path / "cfg.yaml"))
+
+    # the producers were cancelled, not left running in the background
+    assert asyncio.all_tasks() == {asyncio.current_task()}
+    assert list(pd.read_csv(tmp_path / "out" / "report.csv")["doi"]) == ["10.1/0", "10.1/1", "10.1/2"]
+    assert (tmp_path / "out" / "report.xlsx").exists()
@@ -1,6 +1,6 @@
 from pathlib import Path
 import json
-from pdfharvest.cache import sanitize_filename, cache_write, cache_read, cache_path
+from pdfharvest.cache import CacheStore, sanitize_filename, cache_write, cache_read, cache_path, open_cache_store
 
 
 def test_sanitize_filename_basic():
@@ -45,8 +45,70 @@ def test_cache_path_builds_correct_path(tmp_path: Path):
     """Ensure cache_path creates proper safe path structure."""
     doi = "10.1038/s41586-020-2649-2"
     path = cache_path(tmp_path, "unpaywall", doi)
-    expected = tmp_path / "cache" / "unpaywall" / "10.1038_s41586-020-2649-2.json"
+    assert path.parent.parent == tmp_path / "cache" / "unpaywall"
+    assert len(path.parent.name) == 2
+    assert path.name == "10.1038_s41586-020-2649-2.json"
 
-    assert path == expected
-    assert path.parent.name == "unpaywall"
-    assert path.suffix == ".json"
+
+def test_cache_store_imports_json_cache(tmp_path: Path):
+    """The SQLite store picks up existing JSON entries on first open and round-trips new ones."""
+    doi = "10.1038/s41586-020-2649-2"
+    cache_write(cache_path(tmp_path, "crossref", doi), {"title": ["Array programming with NumPy"]})
+
+    with open_cache_store(tmp_path) as store:
+        assert store.get(doi, "crossref") == {"title": ["Array programming with NumPy"]}
+        store.put(doi, "unpaywall", {"is_oa": True})
+        assert store.get(doi, "unpaywall") == {"is_oa": True}
+        assert store.get("10.1000/missing", "crossref") == {}
+
+
+def test_cache_store_imports_json_written_after_creation(tmp_path: Path):
+    """JSON entries that appear after the database exists are imported; stored keys win."""
+    open_cache_store(tmp_path).close()
+    with open_cache_store(tmp_path) as store:
+        store.put("10.1/a", "crossref", {"title": ["Stored"]})
+
+    cache_write(cache_path(tmp_path, "crossref", "10.1/a"), {"title": ["Old JSON"]})
+    cache_write(cache_path(tmp_path, "crossref", "10.1/b"), {"title": ["New JSON"]})
+
+    with open_cache_store(tmp_path) as store:
+        assert store.get("10.1/a", "crossref") == {"title": ["Stored"]}
+        assert store.get("10.1/b", "crossref") == {"title": ["New JSON"]}
+
+
+def test_cache_store_get_many_returns_hits_only(tmp_path: Path):
+    """get_many() maps the original DOIs to their entries and leaves misses out."""
+    with open_cache_store(tmp_path) as store:
+        store.put("doi:10.1/a", "crossref", {"title": ["A"]})
+        store.put("10.1/b", "crossref", {"title": ["B"]})
+        store.put("10.1/b", "unpaywall", {"is_oa": True})
+
+        hits = store.get_many(["doi:10.1/a", "10.1/b", "10.1/c"], "crossref")
+        assert hits == {"doi:10.1/a": {"title": ["A"]}, "10.1/b": {"title": ["B"]}}
+        assert store.get_many([], "crossref") == {}
+
+
+def test_cache_store_put_many_round_trips(tmp_path: Path):
+    """put_many() writes every entry in one call; get_many() reads them back."""
+    with open_cache_store(tmp_path) as store:
+        store.put_many({"10.1/a": {"title": ["A"]}, "10.1/b": {"title": ["B"]}}, "done")
+        assert store.get_many(["10.1/a", "10.1/b"], "done") == {
+            "10.1/a": {"title": ["A"]}, "10.1/b": {"title": ["B"]}
+        }
+
+
+def test_cache_store_commits_in_batches(tmp_path: Path):
+    """Puts are grouped into one transaction per flush_every entries; close() commits the rest."""
+    db = tmp_path / "cache.sqlite3"
+    store = CacheStore(db, flush_every=2)
+    reader = CacheStore(db)
+
+    store.put("10.1/a", "crossref", {"n": 1})
+    assert reader.get("10.1/a", "crossref") == {}
+    store.put("10.1/b", "crossref", {"n": 2})
+    assert reader.get("10.1/a", "crossref") == {"n": 1}
+
+    store.put("10.1/c", "crossref", {"n": 3})
+    store.close()
+    assert reader.get("10.1/c", "crossref") == {"n": 3}
+    reader.close()
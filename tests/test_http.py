@@ -2,7 +2,7 @@
 import pytest
 import httpx
 from pathlib import Path
-from pdfharvest.http import best_pdf_url, download_pdf
+from pdfharvest.http import AdaptiveLimit, backoff_wait, best_pdf_url, download_pdf, fetch_crossref_bulk, retry_after_seconds
 
 def test_best_pdf_url_prefers_best_oa():
     ua = {
@@ -18,6 +18,17 @@ def test_best_pdf_url_fallback_to_oa():
     }
     assert best_pdf_url(ua) == "https://example.com/pdf2.pdf"
 
+def test_retry_after_seconds_parses_delta_and_date():
+    assert retry_after_seconds("7") == 7.0
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert retry_after_seconds("soon") is None
+    assert retry_after_seconds(None) is None
+
+def test_backoff_wait_honours_server_hint():
+    for _ in range(20):
+        assert 30.0 <= backoff_wait(0, retry_after=30.0) <= 45.0
+        assert backoff_wait(10, retry_after=500.0) == 60.0
+
 @pytest.mark.asyncio
 async def test_download_pdf(tmp_path: Path):
 
@@ -25,3 +36,36 @@ async def test_download_pdf(tmp_path: Path):
     async with httpx.AsyncClient() as client:
         ok = await download_pdf(client, "https://nonexistent.example/fake.pdf", out_path)
         assert ok is False
+
+@pytest.mark.asyncio
+async def test_fetch_crossref_bulk_keys_by_lowercased_doi():
+    seen = []
+
+    def handler(request):
+        seen.append(request.url.params)
+        return httpx.Response(200, json={"message": {"items": [{"DOI": "10.1/ABC", "title": ["X"]}]}})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        out = await fetch_crossref_bulk(client, ["10.1/ABC", "10.1/missing"], "me@example.com")
+
+    assert out == {"10.1/abc": {"DOI": "10.1/ABC", "title": ["X"]}}
+    assert seen[0]["filter"] == "doi:10.1/ABC,doi:10.1/missing"
+    assert seen[0]["mailto"] == "me@example.com"
+
+@pytest.mark.asyncio
+async def test_adaptive_limit_throttles_on_429_and_recovers():
+    limit = AdaptiveLimit(3)
+    await limit.observe(httpx.Response(429))
+    await limit.observe(httpx.Response(429))
+    assert limit.limit == 1
+
+    async with limit:
+        assert limit.active == 1
+    for _ in range(3):
+        await limit.observe(httpx.Response(200))
+    assert limit.limit == 3
+
+    await limit.observe(httpx.Response(429))
+    await limit.observe(httpx.Response(429))
+    await limit.observe(httpx.Response(429))
+    assert limit.limit == 1
@@ -1,18 +1,27 @@
 import pytest
+import pandas as pd
 from unittest.mock import AsyncMock, patch
-from pdfharvest.orchestrator import run_batch
+import os
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from reportlab.pdfgen import canvas
+from pdfharvest import orchestrator
+from pdfharvest.orchestrator import _read_dois, _search, run_batch
+from pdfharvest.cache import open_cache_store
 from pdfharvest.config import AppConfig
 
 @pytest.mark.asyncio
 async def test_run_batch_dry_run(tmp_path):
-    cfg = AppConfig(data_dir=tmp_path, email="test@example.com")
+    cfg = AppConfig(data_dir=tmp_path, email="test@example.com", output_dir=tmp_path / "out")
 
 
     mock_fetch_crossref = AsyncMock(return_value={"title": "Fake Paper"})
     mock_fetch_unpaywall = AsyncMock(return_value={"best_oa_location": {"url_for_pdf": "https://fake.pdf"}})
     mock_download_pdf = AsyncMock(return_value=True)
 
-    with patch("pdfharvest.orchestrator.fetch_crossref", mock_fetch_crossref), \
+    with patch("pdfharvest.orchestrator.fetch_crossref_bulk", AsyncMock(return_value={})), \
+         patch("pdfharvest.orchestrator.fetch_crossref", mock_fetch_crossref), \
          patch("pdfharvest.orchestrator.fetch_unpaywall", mock_fetch_unpaywall), \
          patch("pdfharvest.orchestrator.download_pdf", mock_download_pdf):
         
@@ -22,3 +31,156 @@ async def test_run_batch_dry_run(tmp_path):
     mock_fetch_unpaywall.assert_called()
     
     mock_download_pdf.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_run_batch_skips_dois_filed_by_previous_run(tmp_path):
+    pd.DataFrame({"doi": ["10.1/a", "10.1/b"]}).to_excel(tmp_path / "in.xlsx", index=False)
+    cfg = AppConfig(email="test@example.com", output_dir=tmp_path / "out",
+                    input_excel=tmp_path / "in.xlsx", strings=["needle"])
+
+    async def fake_download(client, url, out_path):
+        if "10.1_b" in out_path.name:
+            return False
+        out_path.write_bytes(b"%PDF-1.4 not really")
+        return True
+
+    for expected_downloads in (2, 1):
+        mock_download_pdf = AsyncMock(side_effect=fake_download)
+        with patch("pdfharvest.orchestrator.fetch_crossref_bulk", AsyncMock(return_value={})), \
+             patch("pdfharvest.orchestrator.fetch_crossref", AsyncMock(return_value={"title": ["T"]})), \
+             patch("pdfharvest.orchestrator.fetch_unpaywall",
+                   AsyncMock(return_value={"best_oa_location": {"url_for_pdf": "https://fake.pdf"}})), \
+             patch("pdfharvest.orchestrator.download_pdf", mock_download_pdf):
+            rows = await run_batch(cfg)
+
+        assert mock_download_pdf.call_count == expected_downloads
+        assert [r["doi"] for r in rows] == ["10.1/a", "10.1/b"]
+        assert rows[0]["pdf_final_path"].endswith("10.1_a.pdf")
+
+
+@pytest.mark.asyncio
+async def test_run_batch_uses_crossref_bulk_results(tmp_path):
+    pd.DataFrame({"doi": ["10.1/A", "10.1/b"]}).to_excel(tmp_path / "in.xlsx", index=False)
+    cfg = AppConfig(email="test@example.com", output_dir=tmp_path / "out", input_excel=tmp_path / "in.xlsx")
+
+    mock_fetch_crossref = AsyncMock(return_value={"title": ["Single"]})
+    with patch("pdfharvest.orchestrator.fetch_crossref_bulk",
+               AsyncMock(return_value={"10.1/a": {"DOI": "10.1/A", "title": ["Bulk"]}})), \
+         patch("pdfharvest.orchestrator.fetch_crossref", mock_fetch_crossref), \
+         patch("pdfharvest.orchestrator.fetch_unpaywall", AsyncMock(return_value={})):
+        rows = await run_batch(cfg, dry_run=True)
+
+    assert [r["title"] for r in rows] == ["Bulk", "Single"]
+    mock_fetch_crossref.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_run_batch_dedups_dois_case_insensitively(tmp_path):
+    pd.DataFrame({"doi": ["10.1/A", " 10.1/a ", " ", "10.1/b"]}).to_excel(tmp_path / "in.xlsx", index=False)
+    cfg = AppConfig(email="test@example.com", output_dir=tmp_path / "out", input_excel=tmp_path / "in.xlsx")
+
+    mock_fetch_unpaywall = AsyncMock(return_value={})
+    with patch("pdfharvest.orchestrator.fetch_crossref_bulk", AsyncMock(return_value={})), \
+         patch("pdfharvest.orchestrator.fetch_crossref", AsyncMock(return_value={"title": ["T"]})), \
+         patch("pdfharvest.orchestrator.fetch_unpaywall", mock_fetch_unpaywall):
+        rows = await run_batch(cfg, dry_run=True)
+
+    assert [r["doi"] for r in rows] == ["10.1/A", "10.1/b"]
+    assert mock_fetch_unpaywall.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_run_batch_reuses_cache_of_mixed_case_doi(tmp_path):
+    pd.DataFrame({"doi": ["10.1/MixedCase"]}).to_excel(tmp_path / "in.xlsx", index=False)
+    cfg = AppConfig(email="test@example.com", output_dir=tmp_path / "out", input_excel=tmp_path / "in.xlsx")
+    with open_cache_store(tmp_path / "out") as store:
+        store.put("10.1/MixedCase", "crossref", {"title": ["Cached"]})
+        store.put("10.1/MixedCase", "unpaywall", {"is_oa": False})
+
+    mock_fetch_crossref = AsyncMock(return_value={})
+    mock_fetch_unpaywall = AsyncMock(return_value={})
+    with patch("pdfharvest.orchestrator.fetch_crossref_bulk", AsyncMock(return_value={})), \
+         patch("pdfharvest.orchestrator.fetch_crossref", mock_fetch_crossref), \
+         patch("pdfharvest.orchestrator.fetch_unpaywall", mock_fetch_unpaywall):
+        rows = await run_batch(cfg, dry_run=True)
+
+    assert rows[0]["title"] == "Cached"
+    mock_fetch_crossref.assert_not_called()
+    mock_fetch_unpaywall.assert_not_called()
+
+
+def test_read_dois_reuses_parsed_list_until_the_file_changes(tmp_path):
+    xlsx = tmp_path / "in.xlsx"
+    pd.DataFrame({"doi": [" 10.1/a ", None, "10.1/b"], "other": [1, 2, 3]}).to_excel(xlsx, index=False)
+
+    assert _read_dois(xlsx, "doi", tmp_path) == ["10.1/a", "10.1/b"]
+    with patch("pdfharvest.orchestrator.pd.read_excel", side_effect=AssertionError("re-parsed")):
+        assert _read_dois(xlsx, "doi", tmp_path) == ["10.1/a", "10.1/b"]
+
+    pd.DataFrame({"doi": ["10.1/c"]}).to_excel(xlsx, index=False)
+    assert _read_dois(xlsx, "doi", tmp_path) == ["10.1/c"]
+
+
+def test_read_dois_honours_cache_settings(tmp_path):
+    xlsx = tmp_path / "in.xlsx"
+    pd.DataFrame({"doi": ["10.1/a"]}).to_excel(xlsx, index=False)
+    out = tmp_path / "out"
+
+    # cache disabled: nothing written, so the next call parses again
+    assert _read_dois(xlsx, "doi", out, use_cache=False) == ["10.1/a"]
+    assert not (out / "cache" / "dois").exists()
+
+    assert _read_dois(xlsx, "doi", out) == ["10.1/a"]
+    real_read_excel = pd.read_excel
+    with patch("pdfharvest.orchestrator.pd.read_excel", side_effect=real_read_excel) as parse:
+        _read_dois(xlsx, "doi", out, refresh=True)
+        _read_dois(xlsx, "doi", out, use_cache=False)
+    assert parse.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_search_rebuilds_broken_pool(tmp_path):
+    pdf_path = tmp_path / "sample.pdf"
+    c = canvas.Canvas(str(pdf_path))
+    c.drawString(100, 750, "AGH University")
+    c.save()
+
+    broken = ProcessPoolExecutor(max_workers=1)
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result()
+    orchestrator._POOL = broken
+
+    result = await _search(pdf_path, ("agh university",), {})
+
+    assert result["matches"] == ["agh university"]
+    assert orchestrator._POOL is not broken
+
+
+class _AlwaysBroken:
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("worker died")
+
+@pytest.mark.asyncio
+async def test_failed_search_is_not_recorded_as_done(tmp_path):
+    pd.DataFrame({"doi": ["10.1/a"]}).to_excel(tmp_path / "in.xlsx", index=False)
+    cfg = AppConfig(email="test@example.com", output_dir=tmp_path / "out",
+                    input_excel=tmp_path / "in.xlsx", strings=["needle"])
+
+    async def fake_download(client, url, out_path):
+        out_path.write_bytes(b"%PDF-1.4 not really")
+        return True
+
+    with patch("pdfharvest.orchestrator._search_pool", lambda broken=None: _AlwaysBroken()), \
+         patch("pdfharvest.orchestrator.fetch_crossref_bulk", AsyncMock(return_value={})), \
+         patch("pdfharvest.orchestrator.fetch_crossref", AsyncMock(return_value={"title": ["T"]})), \
+         patch("pdfharvest.orchestrator.fetch_unpaywall",
+               AsyncMock(return_value={"best_oa_location": {"url_for_pdf": "https://fake.pdf"}})), \
+         patch("pdfharvest.orchestrator.download_pdf", AsyncMock(side_effect=fake_download)):
+        rows = await run_batch(cfg)
+
+    assert rows[0]["pdf_final_path"] == ""
+    assert Path(rows[0]["pdf_temp_path"]).exists()
+    assert not list((tmp_path / "out" / "output_notfound").glob("*.pdf"))
+    with open_cache_store(tmp_path / "out") as store:
+        assert store.get_many(["10.1/a"], "done") == {}
@@ -1,6 +1,10 @@
 # tests/test_pdfops.py
+import asyncio
+import errno
+import pytest
+import time
 from pathlib import Path
-from pdfharvest.pdfops import move_pdf_atomic, search_pdf
+from pdfharvest.pdfops import move_pdf_atomic, prepare_needles, search_pdf
 from reportlab.pdfgen import canvas
 
 def test_move_pdf_atomic(tmp_path: Path):
@@ -19,6 +23,49 @@ def test_move_pdf_atomic(tmp_path: Path):
     assert moved2.name.startswith("file_")
     assert not new_src.exists()
 
+def test_move_pdf_atomic_across_filesystems(tmp_path: Path, monkeypatch):
+
+    src = tmp_path / "file.pdf"
+    src.write_bytes(b"%PDF test")
+    real_replace = Path.replace
+
+    def replace(self, target):
+        if self == src:
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        return real_replace(self, target)
+
+    monkeypatch.setattr(Path, "replace", replace)
+    moved_path = move_pdf_atomic(src, tmp_path / "dest")
+    assert moved_path.read_bytes() == b"%PDF test"
+    assert not src.exists()
+    assert not (tmp_path / "dest" / "file.pdf.part").exists()
+
+def test_move_pdf_atomic_concurrent_collision(tmp_path: Path, monkeypatch):
+
+    # sanitized names can clash (10.1/a:b and 10.1/a_b) and the moves run
+    # concurrently: none may overwrite another's PDF
+    real_replace = Path.replace
+
+    def slow_replace(self, target):
+        time.sleep(0.05)
+        return real_replace(self, target)
+
+    monkeypatch.setattr(Path, "replace", slow_replace)
+    srcs = []
+    for i in range(8):
+        src = tmp_path / f"dl{i}" / "same.pdf"
+        src.parent.mkdir()
+        src.write_text(str(i))
+        srcs.append(src)
+    dest_dir = tmp_path / "dest"
+
+    async def move_all():
+        return await asyncio.gather(*(asyncio.to_thread(move_pdf_atomic, s, dest_dir) for s in srcs))
+
+    finals = asyncio.run(move_all())
+    assert len(set(finals)) == 8
+    assert sorted(p.read_text() for p in finals) == [str(i) for i in range(8)]
+
 def make_pdf(path: Path, text: str):
     
     c = canvas.Canvas(str(path))
@@ -38,3 +85,36 @@ def test_search_pdf_finds_text(tmp_path: Path):
     assert "idub" in result["matches"]
     assert isinstance(result["pages"], list)
     assert 1 in result["pages"]
+
+def test_search_pdf_with_prepared_needles(tmp_path: Path):
+
+    pdf_path = tmp_path / "sample.pdf"
+    make_pdf(pdf_path, "This document mentions AGH University.")
+
+    needles = prepare_needles(["AGH University", "agh university", "IDUB"])
+    assert needles == ("agh university", "idub")
+    assert search_pdf(pdf_path, needles, casefolded=True)["matches"] == ["agh university"]
+
+def test_search_pdf_stops_once_every_needle_matched(tmp_path: Path):
+
+    pdf_path = tmp_path / "two_pages.pdf"
+    c = canvas.Canvas(str(pdf_path))
+    c.drawString(100, 750, "AGH University, IDUB")
+    c.showPage()
+    c.drawString(100, 750, "IDUB again")
+    c.save()
+
+    assert search_pdf(pdf_path, ["AGH University", "IDUB"])["pages"] == [1]
+    assert search_pdf(pdf_path, ["AGH University", "IDUB"], want_all_pages=True)["pages"] == [1, 2]
+    assert search_pdf(pdf_path, ["IDUB"], want_all_pages=True, stop_on_first_match=True)["pages"] == [1]
+
+def test_search_pdf_bytes_prefilter_skips_parsing(tmp_path: Path, monkeypatch):
+
+    pdf_path = tmp_path / "plain.pdf"
+    c = canvas.Canvas(str(pdf_path), pageCompression=0)
+    c.drawString(100, 750, "AGH University")
+    c.save()
+
+    assert search_pdf(pdf_path, ["agh university"], bytes_prefilter=True)["found"] is True
+    monkeypatch.setattr("pdfharvest.pdfops.pymupdf.open", lambda *a, **k: pytest.fail("parsed"))
+    assert search_pdf(pdf_path, ["IDUB"], bytes_prefilter=True)["found"] is False